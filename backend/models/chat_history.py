@@ -0,0 +1,164 @@
+# Compaction of chat history
+
+from typing import Callable, Dict, List
+
+from backend.utils.utils_tokens import estimate_tokens
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+
+# Create logger object
+logger = Logger(__name__)
+
+CHAT_HISTORY_TOKENS = REGISTRY.histogram(
+    "chat_history_tokens",
+    "Estimated tokens of the history sent with each chat turn",
+    ("model",),
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072),
+)
+CHAT_HISTORY_COMPACTIONS = REGISTRY.counter(
+    "chat_history_compactions", "Chat history compactions", ("model",)
+)
+CHAT_HISTORY_TOKENS_SAVED = REGISTRY.counter(
+    "chat_history_tokens_saved",
+    "Estimated history tokens removed by compaction",
+    ("model",),
+)
+
+# Prefix of the message carrying the summary of older turns
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_PROMPT = """Summarize the following conversation between a user and an assistant. Keep facts, \
+decisions, names and open questions the assistant needs to continue the conversation. Be concise.
+
+{conversation}"""
+
+
+def text_model_summarizer(text_model) -> Callable[[List[Dict[str, str]]], str]:
+    """Summarizer for ChatHistoryPolicy which asks a text model for the summary.
+
+    Args:
+        text_model: TextModel, preferably a fast one, e.g. TextModel("gemini-1.5-flash-001")
+
+    Returns:
+        Function summarizing a list of messages
+    """
+
+    def summarize(messages: List[Dict[str, str]]) -> str:
+        conversation = "\n".join(
+            f"{message['role']}: {message['text']}" for message in messages
+        )
+        return text_model.predict(SUMMARY_PROMPT.format(conversation=conversation))
+
+    return summarize
+
+
+class ChatHistoryPolicy:
+    """
+    Keeps the history sent with each chat turn within a token budget.
+
+    When the history grows over max_tokens, the oldest turns are dropped until it fits in target_tokens
+    (half of max_tokens by default, so the session is not rebuilt on every turn). With a summarizer the
+    dropped turns are replaced by a summary, which is itself folded into the next summary. The most recent
+    keep_turns turns are always kept.
+
+    Example:
+        policy = ChatHistoryPolicy(max_tokens=8000, summarizer=text_model_summarizer(TextModel(...)))
+        chat = MyChatModel("gemini-1.5-pro", history_policy=policy)
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 8192,
+        target_tokens: int = None,
+        keep_turns: int = 2,
+        summarizer: Callable[[List[Dict[str, str]]], str] = None,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ) -> None:
+        """Initializer
+
+        Args:
+            max_tokens: History size which triggers a compaction
+            target_tokens: History size after a compaction. Default is max_tokens / 2.
+            keep_turns: Number of most recent turns (user message and model response) always kept
+            summarizer: Function returning the summary of a list of messages. Default is None, i.e. older
+                turns are dropped.
+            count_tokens: Function counting the tokens of a text
+        """
+        self.max_tokens = max_tokens
+        self.target_tokens = target_tokens or max_tokens // 2
+        self.keep_turns = keep_turns
+        self.summarizer = summarizer
+        self.count_tokens = count_tokens
+
+    def tokens(self, history: List[Dict[str, str]]) -> int:
+        """Tokens of a history.
+
+        Args:
+            history: List of messages
+
+        Returns:
+            Number of tokens
+        """
+        return sum(self.count_tokens(message["text"]) for message in history)
+
+    def apply(
+        self, history: List[Dict[str, str]], model: str = ""
+    ) -> List[Dict[str, str]]:
+        """Compact a history which is over the budget.
+
+        Args:
+            history: List of messages, as returned by MyChatModel.get_history()
+            model: Model name used in metrics
+
+        Returns:
+            Compacted history, or None when the history is within the budget
+        """
+        tokens = self.tokens(history)
+        CHAT_HISTORY_TOKENS.observe(tokens, model=model)
+        if tokens <= self.max_tokens:
+            return None
+
+        # Keep the longest suffix of whole turns (starting with a user message) which fits in target_tokens,
+        # but at least the last keep_turns turns
+        sizes = [self.count_tokens(message["text"]) for message in history]
+        starts = [i for i, message in enumerate(history) if message["role"] == "user"]
+        if self.keep_turns <= 0:
+            keep_from = len(history)
+        elif len(starts) >= self.keep_turns:
+            keep_from = starts[-self.keep_turns]
+        else:
+            keep_from = 0
+        for start in starts:
+            if start >= keep_from:
+                break
+            if sum(sizes[start:]) <= self.target_tokens:
+                keep_from = start
+                break
+
+        dropped, kept = history[:keep_from], history[keep_from:]
+        if not dropped:
+            return None
+
+        compacted = kept
+        if self.summarizer is not None:
+            try:
+                summary = self.summarizer(dropped)
+            except Exception as e:
+                # Dropping the older turns still bounds the history
+                logger.error("Chat history summarization failed: %s.", e)
+            else:
+                compacted = [
+                    {"role": "user", "text": SUMMARY_PREFIX + summary},
+                    {"role": "model", "text": "Understood."},
+                ] + kept
+
+        saved = tokens - self.tokens(compacted)
+        CHAT_HISTORY_COMPACTIONS.inc(model=model)
+        CHAT_HISTORY_TOKENS_SAVED.inc(max(saved, 0), model=model)
+        logger.info(
+            "Compacted chat history from %s to %s messages, %s tokens saved",
+            len(history),
+            len(compacted),
+            saved,
+        )
+        return compacted
@@ -0,0 +1,230 @@
+# Chat sessions of many users with bounded memory
+
+import collections
+import json
+import threading
+import time
+from typing import Dict, List
+
+from backend.models.chat_history import ChatHistoryPolicy
+from backend.models.language import MyChatModel
+from cache.backends import CacheBackend
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+
+# Create logger object
+logger = Logger(__name__)
+
+CHAT_SESSIONS = REGISTRY.gauge(
+    "chat_sessions", "Chat sessions held in memory", ("model",)
+)
+CHAT_SESSION_EVICTIONS = REGISTRY.counter(
+    "chat_session_evictions",
+    "Chat sessions removed from memory by reason (ttl, max_sessions, max_history_bytes)",
+    ("model", "reason"),
+)
+CHAT_SESSION_RESTORES = REGISTRY.counter(
+    "chat_session_restores", "Chat sessions restored from the store", ("model",)
+)
+
+
+class _Session:
+    """Chat model of a session with its bookkeeping"""
+
+    def __init__(self, chat: MyChatModel, history_bytes: int) -> None:
+        self.chat = chat
+        self.history_bytes = history_bytes
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class ChatSessionManager:
+    """
+    Holds the chat sessions of many users, keyed by session id.
+
+    Sessions are created on first use and kept in memory up to max_sessions sessions and max_history_bytes
+    of history in total. Sessions idle for more than ttl seconds, and the least recently used ones over the
+    limits, are evicted. With a store (e.g. an SQLiteCache shared by the workers of a node) the history is
+    saved after every turn, so an evicted session, or a session of a restarted worker, continues where it
+    stopped. Entries of the store expire after store_ttl seconds.
+
+    Example:
+        sessions = ChatSessionManager("gemini-1.5-pro", store=create_cache("sqlite", path=...))
+        text = sessions.send_message(session_id, prompt)
+    """
+
+    def __init__(
+        self,
+        model: str,
+        parameters: Dict[str, str] = None,
+        max_sessions: int = 1000,
+        max_history_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 1800,
+        store: CacheBackend = None,
+        store_ttl: float = 7 * 24 * 3600,
+        history_policy: ChatHistoryPolicy = None,
+    ) -> None:
+        """Initializer
+
+        Args:
+            model: Chat model name
+            parameters: The parameters used for the model
+            max_sessions: Maximum number of sessions in memory
+            max_history_bytes: Maximum size of the history of all sessions in memory
+            ttl: Seconds after which an idle session is evicted from memory
+            store: Store the history of sessions is saved to. Default is None, i.e. evicted sessions are lost.
+            store_ttl: Seconds the history of a session stays in the store after its last turn
+            history_policy: Policy compacting the history of each session before a turn
+        """
+        self.model = model
+        self.parameters = parameters
+        self.max_sessions = max_sessions
+        self.max_history_bytes = max_history_bytes
+        self.ttl = ttl
+        self.store = store
+        self.store_ttl = store_ttl
+        self.history_policy = history_policy
+
+        self._sessions = collections.OrderedDict()
+        self._history_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> MyChatModel:
+        """Chat model of a session, restored from the store or created when it is not in memory.
+
+        Args:
+            session_id: Session id
+
+        Returns:
+            Chat model of the session
+        """
+        return self._session(session_id).chat
+
+    def send_message(self, session_id: str, prompt: str) -> str:
+        """Send a message in a session and save the history of the session.
+
+        Turns of a session are sent one at a time, turns of different sessions concurrently.
+
+        Args:
+            session_id: Session id
+            prompt: User message
+
+        Returns:
+            Model response
+        """
+        session = self._session(session_id)
+        with session.lock:
+            text = session.chat.get_chat_response(prompt)
+            self._save(session_id, session)
+        return text
+
+    def end(self, session_id: str) -> None:
+        """Forget a session, in memory and in the store.
+
+        Args:
+            session_id: Session id
+        """
+        with self._lock:
+            self._remove(session_id)
+            CHAT_SESSIONS.set(len(self._sessions), model=self.model)
+        if self.store is not None:
+            self.store.delete(self._store_key(session_id))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _session(self, session_id: str) -> _Session:
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return session
+
+        # Restore outside of the lock, reading the store is I/O
+        history = self._load(session_id)
+        chat = MyChatModel(
+            self.model,
+            self.parameters,
+            history=history,
+            history_policy=self.history_policy,
+        )
+        session = _Session(chat, len(json.dumps(history)) if history else 0)
+
+        with self._lock:
+            existing = self._sessions.get(session_id)
+            if existing is not None:
+                # Created concurrently by another request of the session
+                return existing
+            self._sessions[session_id] = session
+            self._history_bytes += session.history_bytes
+            self._evict_over_limits()
+            CHAT_SESSIONS.set(len(self._sessions), model=self.model)
+        return session
+
+    def _load(self, session_id: str) -> List[Dict[str, str]]:
+        if self.store is None:
+            return None
+        try:
+            value = self.store.get(self._store_key(session_id))
+        except Exception as e:
+            logger.error("Chat session store failed: %s.", e)
+            return None
+        if value is None:
+            return None
+        CHAT_SESSION_RESTORES.inc(model=self.model)
+        return json.loads(value)
+
+    def _save(self, session_id: str, session: _Session) -> None:
+        history = session.chat.get_history()
+        value = json.dumps(history).encode("utf-8")
+
+        with self._lock:
+            # Unless the session was evicted during the turn
+            if self._sessions.get(session_id) is session:
+                self._history_bytes += len(value) - session.history_bytes
+                session.history_bytes = len(value)
+                self._evict_over_limits(keep=session_id)
+
+        if self.store is not None:
+            try:
+                self.store.set(self._store_key(session_id), value, self.store_ttl)
+            except Exception as e:
+                # The session goes on in memory, only surviving a restart is lost
+                logger.error("Chat session store failed: %s.", e)
+
+    def _store_key(self, session_id: str) -> str:
+        return f"ChatSession:{self.model}:{session_id}"
+
+    def _evict_expired(self) -> None:
+        # Sessions are ordered by last use, expired ones are at the start
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > deadline:
+                break
+            self._remove(session_id)
+            CHAT_SESSION_EVICTIONS.inc(model=self.model, reason="ttl")
+
+    def _evict_over_limits(self, keep: str = None) -> None:
+        while len(self._sessions) > self.max_sessions or (
+            self._history_bytes > self.max_history_bytes and len(self._sessions) > 1
+        ):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                self._sessions.move_to_end(session_id)
+                session_id = next(iter(self._sessions))
+            reason = (
+                "max_sessions"
+                if len(self._sessions) > self.max_sessions
+                else "max_history_bytes"
+            )
+            self._remove(session_id)
+            CHAT_SESSION_EVICTIONS.inc(model=self.model, reason=reason)
+        CHAT_SESSIONS.set(len(self._sessions), model=self.model)
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._history_bytes -= session.history_bytes
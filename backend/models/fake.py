@@ -0,0 +1,460 @@
+# Local stand-in for the Vertex AI models, for offline load testing
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import struct
+import time
+import zlib
+from typing import Any, Dict, Hashable, List
+
+from backend.models.registry import MODELS
+from backend.utils.utils_lazy import lazy_import
+from backend.utils.utils_tokens import estimate_tokens
+from logger.logging import Logger
+
+# Create logger object
+logger = Logger(__name__)
+
+# Vertex AI SDK modules, imported on first use. Only their local response types are used.
+generative_models = lazy_import("vertexai.generative_models")
+language_models = lazy_import("vertexai.language_models")
+preview_vision_models = lazy_import("vertexai.preview.vision_models")
+api_exceptions = lazy_import("google.api_core.exceptions")
+
+# Words of the generated texts
+_WORDS = (
+    "the model generates a fake answer for load testing of the serving stack with "
+    "deterministic text latency streaming errors and function calls without any network"
+).split()
+
+
+class FakeSettings:
+    """
+    Behaviour of the fake models.
+
+    Latencies follow a log-normal distribution: most calls take about latency_median seconds, sigma
+    controls the tail (0 for a constant latency). Streams send their first chunk after the latency, then
+    one chunk of chunk_tokens tokens every chunk_tokens / tokens_per_second seconds.
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.5,
+        output_tokens: int = 64,
+        chunk_tokens: int = 8,
+        tokens_per_second: float = 100,
+        error_rate: float = 0.0,
+        function_calls: bool = True,
+        image_size: int = 64,
+    ) -> None:
+        """Initializer
+
+        Args:
+            latency_median: Median seconds until the response (or its first chunk)
+            latency_sigma: Sigma of the log-normal latency distribution
+            output_tokens: Number of tokens of generated texts
+            chunk_tokens: Number of tokens of each streamed chunk
+            tokens_per_second: Rate of streamed tokens after the first chunk
+            error_rate: Fraction of calls failing with 503 Service Unavailable
+            function_calls: Answer with a call of the first declared function when tools are given
+            image_size: Width and height of generated images
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.output_tokens = output_tokens
+        self.chunk_tokens = chunk_tokens
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.function_calls = function_calls
+        self.image_size = image_size
+
+    def latency(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_median
+        return random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    def chunk_delay(self) -> float:
+        return self.chunk_tokens / self.tokens_per_second
+
+    def maybe_fail(self, model: str) -> None:
+        if self.error_rate and random.random() < self.error_rate:
+            raise api_exceptions.ServiceUnavailable(f"Fake {model} is unavailable")
+
+
+def _to_text(contents: Any) -> str:
+    """Text of the contents of a request, used to derive the response"""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_to_text(content) for content in contents)
+    to_dict = getattr(contents, "to_dict", None)
+    if callable(to_dict):
+        content = to_dict()
+        inline_data = content.get("inline_data")
+        if inline_data:
+            # Images and other media stand for a fixed number of tokens, not their size
+            digest = hashlib.sha256(str(inline_data["data"]).encode()).hexdigest()
+            return f"<{inline_data.get('mime_type')} {digest[:16]}>"
+        return str(content)
+    return str(contents)
+
+
+def _has_function_response(contents: Any) -> bool:
+    return "function_response" in _to_text(contents)
+
+
+def _generate_text(model: str, prompt: str, tokens: int) -> List[str]:
+    """Deterministic words answering a prompt, about one token each"""
+    seed = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).digest()
+    rng = random.Random(seed)
+    words = [f"[{model}]"] + [rng.choice(_WORDS) for _ in range(max(tokens - 1, 0))]
+    return [f"{word} " for word in words]
+
+
+def _png(size: int, seed: str) -> bytes:
+    """Solid color PNG, the color derived from seed"""
+    color = hashlib.sha256(seed.encode("utf-8")).digest()[:3]
+    raw = b"".join(b"\x00" + color * size for _ in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+class _CountTokensResponse:
+    """Token count, as returned by GenerativeModel.count_tokens"""
+
+    def __init__(self, total_tokens: int) -> None:
+        self.total_tokens = total_tokens
+        self.total_billable_characters = total_tokens * 4
+
+
+class FakeGenerativeModel:
+    """Stand-in for vertexai.generative_models.GenerativeModel"""
+
+    def __init__(
+        self,
+        model_name: str,
+        settings: FakeSettings,
+        function_declarations: List[Dict] = None,
+    ) -> None:
+        """Initializer
+
+        Args:
+            model_name: Model name, part of the generated texts
+            settings: Behaviour of the model
+            function_declarations: Declarations of the tools the model is created with, as dicts
+        """
+        self._model_name = model_name
+        self.settings = settings
+        self.function_declarations = function_declarations or []
+
+    def _function_call(self, contents, tools) -> Dict[str, Any]:
+        """Call of the first declared function, or None when the model answers with text"""
+        declarations = self.function_declarations
+        if tools:
+            declarations = tools[0].to_dict().get("function_declarations", [])
+        if not (self.settings.function_calls and declarations):
+            return None
+        # The function was called, answer its response with text
+        if _has_function_response(contents):
+            return None
+        declaration = declarations[0]
+        properties = (declaration.get("parameters") or {}).get("properties", {})
+        return {
+            "name": declaration["name"],
+            "args": {name: "fake" for name in properties},
+        }
+
+    @staticmethod
+    def _response(parts: List[Dict], prompt_tokens: int, output_tokens: int):
+        return generative_models.GenerationResponse.from_dict(
+            {
+                "candidates": [
+                    {
+                        "content": {"role": "model", "parts": parts},
+                        "finish_reason": "STOP",
+                    }
+                ],
+                "usage_metadata": {
+                    "prompt_token_count": prompt_tokens,
+                    "candidates_token_count": output_tokens,
+                    "total_token_count": prompt_tokens + output_tokens,
+                },
+            }
+        )
+
+    def _responses(self, contents, tools=None) -> List:
+        """Streamed chunks of the response"""
+        self.settings.maybe_fail(self._model_name)
+        prompt = _to_text(contents)
+        prompt_tokens = estimate_tokens(prompt)
+
+        function_call = self._function_call(contents, tools)
+        if function_call is not None:
+            parts = [{"function_call": function_call}]
+            return [self._response(parts, prompt_tokens, 8)]
+
+        words = _generate_text(self._model_name, prompt, self.settings.output_tokens)
+        size = self.settings.chunk_tokens
+        return [
+            self._response(
+                [{"text": "".join(words[i : i + size])}], prompt_tokens, len(words)
+            )
+            for i in range(0, len(words), size)
+        ]
+
+    def _merge(self, responses: List):
+        """Single response of a request which is not streamed"""
+        if len(responses) == 1:
+            return responses[0]
+        usage = responses[-1].usage_metadata
+        return self._response(
+            [{"text": "".join(response.text for response in responses)}],
+            usage.prompt_token_count,
+            usage.candidates_token_count,
+        )
+
+    def generate_content(self, contents, *, tools=None, stream: bool = False, **kwargs):
+        time.sleep(self.settings.latency())
+        responses = self._responses(contents, tools)
+        if not stream:
+            return self._merge(responses)
+
+        def chunks():
+            for index, response in enumerate(responses):
+                if index:
+                    time.sleep(self.settings.chunk_delay())
+                yield response
+
+        return chunks()
+
+    async def generate_content_async(
+        self, contents, *, tools=None, stream: bool = False, **kwargs
+    ):
+        await asyncio.sleep(self.settings.latency())
+        responses = self._responses(contents, tools)
+        if not stream:
+            return self._merge(responses)
+
+        async def chunks():
+            for index, response in enumerate(responses):
+                if index:
+                    await asyncio.sleep(self.settings.chunk_delay())
+                yield response
+
+        return chunks()
+
+    def count_tokens(self, contents, **kwargs) -> _CountTokensResponse:
+        return _CountTokensResponse(estimate_tokens(_to_text(contents)))
+
+    def start_chat(self, history=None, **kwargs) -> "FakeChatSession":
+        return FakeChatSession(self, history)
+
+
+class FakeChatSession:
+    """Stand-in for vertexai.generative_models.ChatSession"""
+
+    def __init__(self, model: FakeGenerativeModel, history=None) -> None:
+        self._model = model
+        self.history = list(history or [])
+
+    @staticmethod
+    def _user_content(content):
+        if not isinstance(content, list):
+            content = [content]
+        parts = [
+            generative_models.Part.from_text(part) if isinstance(part, str) else part
+            for part in content
+        ]
+        return generative_models.Content(role="user", parts=parts)
+
+    def send_message(self, content, **kwargs):
+        user = self._user_content(content)
+        response = self._model.generate_content(self.history + [user])
+        self.history += [user, response.candidates[0].content]
+        return response
+
+    async def send_message_async(self, content, **kwargs):
+        user = self._user_content(content)
+        response = await self._model.generate_content_async(self.history + [user])
+        self.history += [user, response.candidates[0].content]
+        return response
+
+
+class FakeTextGenerationModel:
+    """Stand-in for vertexai.language_models.TextGenerationModel and CodeGenerationModel"""
+
+    def __init__(self, model_name: str, settings: FakeSettings) -> None:
+        self._model_name = model_name
+        self.settings = settings
+
+    def _texts(self, prompt: str) -> List[str]:
+        """Streamed chunks of the response"""
+        self.settings.maybe_fail(self._model_name)
+        words = _generate_text(self._model_name, prompt, self.settings.output_tokens)
+        size = self.settings.chunk_tokens
+        return ["".join(words[i : i + size]) for i in range(0, len(words), size)]
+
+    @staticmethod
+    def _response(text: str):
+        return language_models.TextGenerationResponse(
+            text=text, _prediction_response=None
+        )
+
+    def predict(self, prompt: str, **kwargs):
+        time.sleep(self.settings.latency())
+        return self._response("".join(self._texts(prompt)))
+
+    async def predict_async(self, prompt: str, **kwargs):
+        await asyncio.sleep(self.settings.latency())
+        return self._response("".join(self._texts(prompt)))
+
+    def predict_streaming(self, prompt: str, **kwargs):
+        time.sleep(self.settings.latency())
+        for index, text in enumerate(self._texts(prompt)):
+            if index:
+                time.sleep(self.settings.chunk_delay())
+            yield self._response(text)
+
+    async def predict_streaming_async(self, prompt: str, **kwargs):
+        await asyncio.sleep(self.settings.latency())
+        for index, text in enumerate(self._texts(prompt)):
+            if index:
+                await asyncio.sleep(self.settings.chunk_delay())
+            yield self._response(text)
+
+    def get_tuned_model(self, tuned_model_name: str) -> "FakeTextGenerationModel":
+        return FakeTextGenerationModel(tuned_model_name, self.settings)
+
+
+class FakeChatModel:
+    """Stand-in for vertexai.language_models.ChatModel and CodeChatModel"""
+
+    def __init__(self, model_name: str, settings: FakeSettings) -> None:
+        self._model = FakeTextGenerationModel(model_name, settings)
+
+    def start_chat(self, message_history=None, **kwargs) -> "FakeTextChatSession":
+        return FakeTextChatSession(self._model, message_history)
+
+
+class FakeTextChatSession:
+    """Stand-in for vertexai.language_models.ChatSession"""
+
+    def __init__(self, model: FakeTextGenerationModel, message_history=None) -> None:
+        self._model = model
+        self.message_history = list(message_history or [])
+
+    def send_message(self, message: str, **kwargs):
+        history = "\n".join(message.content for message in self.message_history)
+        response = self._model.predict(f"{history}\n{message}")
+        self.message_history += [
+            language_models.ChatMessage(content=message, author="user"),
+            language_models.ChatMessage(content=response.text, author="bot"),
+        ]
+        return response
+
+
+class FakeImageGenerationModel:
+    """Stand-in for vertexai.preview.vision_models.ImageGenerationModel"""
+
+    def __init__(self, model_name: str, settings: FakeSettings) -> None:
+        self._model_name = model_name
+        self.settings = settings
+
+    def _images(self, prompt: str, number_of_images: int, **parameters):
+        time.sleep(self.settings.latency())
+        self.settings.maybe_fail(self._model_name)
+        parameters = {
+            "prompt": prompt,
+            "number_of_images": number_of_images,
+            **parameters,
+        }
+        return preview_vision_models.ImageGenerationResponse(
+            images=[
+                preview_vision_models.GeneratedImage(
+                    image_bytes=_png(self.settings.image_size, f"{prompt}\0{index}"),
+                    generation_parameters=dict(
+                        parameters, index_of_image_in_batch=index
+                    ),
+                )
+                for index in range(number_of_images)
+            ]
+        )
+
+    def generate_images(
+        self,
+        prompt: str,
+        number_of_images: int = 1,
+        negative_prompt: str = None,
+        **kwargs,
+    ):
+        return self._images(prompt, number_of_images, negative_prompt=negative_prompt)
+
+    def edit_image(
+        self,
+        prompt: str,
+        base_image=None,
+        mask=None,
+        number_of_images: int = 1,
+        negative_prompt: str = None,
+        **kwargs,
+    ):
+        return self._images(prompt, number_of_images, negative_prompt=negative_prompt)
+
+
+def create_fake_model(key: Hashable, settings: FakeSettings) -> Any:
+    """Create the fake of the model endpoint registered under a registry key.
+
+    Args:
+        key: Key built with model_key()
+        settings: Behaviour of the fake
+
+    Returns:
+        Fake model endpoint
+    """
+    kind, model = key[0], key[1]
+    if kind == "ImageGenerationModel":
+        return FakeImageGenerationModel(model, settings)
+    if "gemini-" not in model:
+        if kind == "MyChatModel":
+            return FakeChatModel(model, settings)
+        if kind == "TextModel":
+            fake = FakeTextGenerationModel(model, settings)
+            tuned_model = json.loads(key[2]).get("tuned_model")
+            return fake.get_tuned_model(tuned_model) if tuned_model else fake
+    # The tools of GenerativeModels are serialized in the key, see model_key()
+    tools = json.loads(key[3]) if len(key) > 3 else None
+    return FakeGenerativeModel(model, settings, tools or None)
+
+
+def enable_fake_models(**settings) -> FakeSettings:
+    """Serve every model endpoint of the process from local fakes, without calling Vertex AI.
+
+    Endpoints already registered are dropped. Call it before the first request, e.g. at startup.
+
+    Example:
+        enable_fake_models(latency_median=0.8, latency_sigma=0.6, error_rate=0.01)
+
+    Args:
+        settings: Arguments of FakeSettings
+
+    Returns:
+        Settings of the fakes, which can be changed while serving
+    """
+    fake_settings = FakeSettings(**settings)
+    MODELS.override(lambda key: create_fake_model(key, fake_settings))
+    logger.warning("Model endpoints are served by fakes: %s", vars(fake_settings))
+    return fake_settings
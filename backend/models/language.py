@@ -1,27 +1,59 @@
 """LLM text predictor."""
 
-from typing import Dict
-from vertexai.language_models import (
-    CodeGenerationModel,
-    TextGenerationModel,
-    CodeChatModel,
-)
-from vertexai.language_models import ChatModel
-from vertexai.generative_models import GenerativeModel, GenerationConfig
+import asyncio
+import hashlib
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Tuple, Union
 
+from backend.models.chat_history import ChatHistoryPolicy
+from backend.models.registry import MODELS, model_key
+from backend.models.streaming import AsyncTextStream, TextStream
+from backend.utils.utils_batch import map_bounded
+from backend.utils.utils_lazy import lazy_import
+from backend.utils.utils_retry import CallPolicy, get_call_policy
+from backend.utils.utils_tokens import (
+    PROMPTS_TRIMMED,
+    TOKEN_COUNTER,
+    TokenBudgetExceeded,
+    estimate_tokens,
+    trim_to_budget,
+)
+from cache.backends import CacheBackend
 from logger.logging import Logger
+from metrics.metrics import REGISTRY, instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+# Vertex AI SDK modules, imported on first use
+language_models = lazy_import("vertexai.language_models")
+generative_models = lazy_import("vertexai.generative_models")
+
+MODEL_CACHE_REQUESTS = REGISTRY.counter(
+    "model_cache_requests", "TextModel response cache lookups", ("model", "result")
+)
+
 
 class TextModel:
     """Vertex Text Generation Model Class.
 
+    With a cache, predict() and apredict() return the stored text for a (model, parameters, prompt) seen
+    before instead of calling the model. Only enable it where repeating an earlier generation is
+    acceptable, e.g. low temperature prompts. Use an SQLiteCache to keep responses across restarts and share
+    them between the worker processes of a node:
+
+        TextModel("gemini-1.5-flash-001", {"temperature": 0}, cache=create_cache("sqlite", path=...))
+
+    With max_input_tokens, prompts are checked against the budget before they are sent, so oversized prompts
+    fail (or are trimmed) locally instead of after a slow round trip. Tokens are estimated locally; with
+    exact_token_count, Gemini prompts close to the budget are counted with the count_tokens API.
+
     Attributes:
         model: model name
         parameters: The parameters used for the model.
         llm_endpoint: The endpoint for the model.
+        cache: Response cache, None when disabled.
+        call_policy: Retries, deadline and hedging of model calls.
     """
 
     def __init__(
@@ -29,6 +61,13 @@ class TextModel:
         model: str,
         parameters: Dict[str, str] = {"temperature": 0.5},
         tuned_model: str = None,
+        cache: CacheBackend = None,
+        cache_ttl: float = 24 * 3600,
+        call_policy: CallPolicy = None,
+        max_input_tokens: int = None,
+        overflow: str = "error",
+        trim_keep: str = "end",
+        exact_token_count: bool = False,
     ):
         """Generate text based on prompt.
 
@@ -36,24 +75,67 @@ class TextModel:
         model: model name
         parameters: The parameters used for the model.
         tuned_model: Full Qualified Model name: projects/{PROJECT}/locations/{LOCATION}/models/{MODELID}
+        cache: Response cache backend. Default is None, i.e. responses are not cached.
+        cache_ttl: Seconds responses stay cached. Default is one day.
+        call_policy: Retries, deadline and hedging of model calls. Default is the shared policy of the model
+            configured in Config.CALL_POLICIES.
+        max_input_tokens: Token budget of prompts. Default is None, i.e. prompts are not checked.
+        overflow: What to do with prompts over the budget: "error" raises TokenBudgetExceeded, "trim" keeps
+            the part of the prompt which fits.
+        trim_keep: Part of the prompt kept when trimming: "end" (default) keeps the question of prompts laid
+            out as context then question, "start" keeps the beginning.
+        exact_token_count: Count the tokens of Gemini prompts close to the budget with the count_tokens API
         """
 
         self.parameters = parameters
         self.model = model
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.call_policy = call_policy or get_call_policy("TextModel", model)
+        self.max_input_tokens = max_input_tokens
+        self.overflow = overflow
+        self.trim_keep = trim_keep
+        self.exact_token_count = exact_token_count and "gemini-" in model
+
+        # Everything besides the prompt which determines the response
+        self._cache_namespace = json.dumps(
+            {"model": model, "tuned_model": tuned_model, "parameters": parameters},
+            sort_keys=True,
+            default=str,
+        )
 
+        # The endpoint is shared through the model registry, parameters are passed on each call
+        self.llm_endpoint = MODELS.get_or_create(
+            model_key("TextModel", model, {"tuned_model": tuned_model}),
+            lambda: self._create_endpoint(model, tuned_model),
+        )
+        if "gemini-" in model:
+            self.parameters = generative_models.GenerationConfig(**parameters)
+
+    @staticmethod
+    def _create_endpoint(model: str, tuned_model: str = None):
+        """Create the model endpoint.
+
+        Args:
+        model: model name
+        tuned_model: Full Qualified Model name: projects/{PROJECT}/locations/{LOCATION}/models/{MODELID}
+
+        Returns:
+        Model endpoint.
+        """
         if "text-" in model:
-            self.llm_endpoint = TextGenerationModel.from_pretrained(model)
+            llm_endpoint = language_models.TextGenerationModel.from_pretrained(model)
         elif "code-" in model:
-            self.llm_endpoint = CodeGenerationModel.from_pretrained(model)
+            llm_endpoint = language_models.CodeGenerationModel.from_pretrained(model)
         elif "gemini-" in model:
-            self.llm_endpoint = GenerativeModel(model)
-            self.parameters = GenerationConfig(**parameters)
+            llm_endpoint = generative_models.GenerativeModel(model)
         else:
             # Log request for debugging
-            logger.error(f"{model} not supported.")
+            logger.error("%s not supported.", model)
             raise ValueError(f"{model} not supported.")
         if tuned_model and "gemini" not in model:
-            self.llm_endpoint = self.llm_endpoint.get_tuned_model(tuned_model)
+            llm_endpoint = llm_endpoint.get_tuned_model(tuned_model)
+        return llm_endpoint
 
     def predict(self, prompt: str) -> str:
         """Generate text based on prompt.
@@ -63,9 +145,28 @@ class TextModel:
 
         Returns:
         Generated Text.
+
+        Raises:
+        TokenBudgetExceeded: The prompt is over max_input_tokens and overflow is "error".
         """
+        prompt = self.preflight(prompt)
+        if self.cache is None:
+            return self._predict(prompt)
+
+        key = self._cache_key(prompt)
+        text = self._cache_get(key)
+        if text is None:
+            text = self._predict(prompt)
+            self._cache_set(key, text)
+        return text
+
+    def _predict(self, prompt: str) -> str:
+        return self.call_policy.call(self._generate, prompt)
+
+    @instrument("TextModel", "predict")
+    def _generate(self, prompt: str) -> str:
         # Log request for debugging
-        logger.debug(f"Generating Text for prompt: {prompt}")
+        logger.debug("Generating Text for prompt: %s", prompt, event="prompt")
         if "text-" in self.model or "code-" in self.model:
             predict_response = self.llm_endpoint.predict(prompt, **self.parameters).text
         elif "gemini-" in self.model:
@@ -75,40 +176,365 @@ class TextModel:
 
         return predict_response
 
+    async def apredict(self, prompt: str, timeout: float = None) -> str:
+        """Generate text based on prompt without blocking the event loop.
+
+        The call is cancelled when the awaiting task is cancelled, e.g. when the HTTP client disconnects.
+
+        Args:
+        prompt: Prompt
+        timeout: Seconds to wait for the model, including retries. Default is the deadline of the call policy.
+
+        Returns:
+        Generated Text.
+
+        Raises:
+        asyncio.TimeoutError: The model did not respond within timeout.
+        TokenBudgetExceeded: The prompt is over max_input_tokens and overflow is "error".
+        """
+        if self.exact_token_count:
+            # count_tokens is a blocking call
+            prompt = await asyncio.get_running_loop().run_in_executor(
+                None, self.preflight, prompt
+            )
+        else:
+            prompt = self.preflight(prompt)
+        if self.cache is None:
+            return await self._apredict(prompt, timeout)
+
+        # Blocking backends (SQLite) are read and written in the default executor
+        key = self._cache_key(prompt)
+        loop = asyncio.get_running_loop()
+        if self.cache.blocking:
+            text = await loop.run_in_executor(None, self._cache_get, key)
+        else:
+            text = self._cache_get(key)
+        if text is None:
+            text = await self._apredict(prompt, timeout)
+            if self.cache.blocking:
+                await loop.run_in_executor(None, self._cache_set, key, text)
+            else:
+                self._cache_set(key, text)
+        return text
+
+    async def _apredict(self, prompt: str, timeout: float = None) -> str:
+        return await self.call_policy.acall(self._agenerate, prompt, deadline=timeout)
+
+    @instrument("TextModel", "apredict")
+    async def _agenerate(self, prompt: str) -> str:
+        # Log request for debugging
+        logger.debug("Generating Text for prompt: %s", prompt, event="prompt")
+        if "text-" in self.model or "code-" in self.model:
+            response = await self.llm_endpoint.predict_async(prompt, **self.parameters)
+        elif "gemini-" in self.model:
+            response = await self.llm_endpoint.generate_content_async(
+                prompt, generation_config=self.parameters
+            )
+
+        return response.text
+
+    def count_tokens(self, prompt: str, exact: bool = None) -> int:
+        """Number of tokens of a prompt.
+
+        Args:
+        prompt: Prompt
+        exact: Count with the count_tokens API (Gemini models only). Default is exact_token_count.
+
+        Returns:
+        Number of tokens, estimated unless exact.
+        """
+        exact = self.exact_token_count if exact is None else exact
+        if exact and "gemini-" in self.model:
+            return TOKEN_COUNTER.count(self.llm_endpoint, prompt)
+        return estimate_tokens(prompt)
+
+    def preflight(self, prompt: str) -> str:
+        """Check a prompt against max_input_tokens before sending it.
+
+        Args:
+        prompt: Prompt
+
+        Returns:
+        The prompt, trimmed to the budget when it is over it and overflow is "trim".
+
+        Raises:
+        TokenBudgetExceeded: The prompt is over the budget and overflow is "error".
+        """
+        if self.max_input_tokens is None:
+            return prompt
+
+        # The estimate is good enough far from the budget, only prompts close to it are counted exactly
+        tokens = estimate_tokens(prompt)
+        if self.exact_token_count and tokens > 0.8 * self.max_input_tokens:
+            tokens = self.count_tokens(prompt, exact=True)
+        if tokens <= self.max_input_tokens:
+            return prompt
+
+        if self.overflow != "trim":
+            raise TokenBudgetExceeded(
+                f"Prompt of {tokens} tokens is over the {self.max_input_tokens} tokens budget of {self.model}."
+            )
+
+        # Trim with the estimate, scaled to the exact count when there is one
+        budget = self.max_input_tokens * estimate_tokens(prompt) // tokens
+        PROMPTS_TRIMMED.inc(upstream="TextModel")
+        logger.warning(
+            "Trimming prompt of %s tokens to the %s tokens budget of %s",
+            tokens,
+            self.max_input_tokens,
+            self.model,
+        )
+        return trim_to_budget(prompt, budget, keep=self.trim_keep)
+
+    def _cache_key(self, prompt: str) -> str:
+        digest = hashlib.sha256(self._cache_namespace.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt.encode("utf-8"))
+        return f"TextModel:{digest.hexdigest()}"
+
+    def _cache_get(self, key: str) -> str:
+        try:
+            value = self.cache.get(key)
+        except Exception as e:
+            # The cache is an optimisation, the model is called when it fails
+            logger.error("TextModel cache failed: %s.", e)
+            value = None
+        MODEL_CACHE_REQUESTS.inc(
+            model=self.model, result="miss" if value is None else "hit"
+        )
+        return None if value is None else value.decode("utf-8")
+
+    def _cache_set(self, key: str, text: str) -> None:
+        try:
+            self.cache.set(key, text.encode("utf-8"), self.cache_ttl)
+        except Exception as e:
+            logger.error("TextModel cache failed: %s.", e)
+
+    def predict_many(
+        self,
+        prompts: Iterable[str],
+        concurrency: int = 8,
+        ordered: bool = True,
+    ) -> Iterator[Tuple[int, Union[str, Exception]]]:
+        """Generate text for many prompts with bounded concurrency.
+
+        Prompts are read lazily and results are yielded as they are ready, so memory stays flat for any
+        number of prompts. Each prompt is retried by the model's call policy, transient errors only.
+
+        Example:
+            for index, text in model.predict_many(prompts, concurrency=16):
+                if isinstance(text, Exception):
+                    ...
+
+        Args:
+        prompts: Iterable of prompts, e.g. a generator reading a file
+        concurrency: Maximum number of concurrent model calls
+        ordered: Yield results in prompt order. When False results are yielded as they complete.
+
+        Returns:
+        Iterator of (index of the prompt, generated text or the exception of the last attempt) tuples.
+        """
+        return map_bounded(
+            self.predict,
+            prompts,
+            concurrency=concurrency,
+            # predict already retries through the call policy
+            retries=0,
+            ordered=ordered,
+        )
+
+    def predict_stream(self, prompt: str) -> TextStream:
+        """Generate text based on prompt, yielding text chunks as they are generated.
+
+        Args:
+        prompt: Prompt
+
+        Returns:
+        TextStream of generated text chunks, with usage_metadata once exhausted.
+        """
+        return TextStream(self._stream(self.preflight(prompt)))
+
+    def apredict_stream(self, prompt: str) -> AsyncTextStream:
+        """Generate text based on prompt without blocking the event loop, yielding text chunks as they are
+        generated.
+
+        Args:
+        prompt: Prompt
+
+        Returns:
+        AsyncTextStream of generated text chunks, with usage_metadata once exhausted.
+        """
+        return AsyncTextStream(self._astream(self.preflight(prompt)))
+
+    @instrument("TextModel", "predict_stream")
+    def _stream(self, prompt: str) -> Iterator:
+        # Log request for debugging
+        logger.debug("Streaming Text for prompt: %s", prompt, event="prompt")
+        if "text-" in self.model or "code-" in self.model:
+            responses = self.llm_endpoint.predict_streaming(prompt, **self.parameters)
+        elif "gemini-" in self.model:
+            responses = self.llm_endpoint.generate_content(
+                prompt, generation_config=self.parameters, stream=True
+            )
+
+        yield from responses
+
+    @instrument("TextModel", "apredict_stream")
+    async def _astream(self, prompt: str) -> AsyncIterator:
+        # Log request for debugging
+        logger.debug("Streaming Text for prompt: %s", prompt, event="prompt")
+        if "text-" in self.model or "code-" in self.model:
+            responses = self.llm_endpoint.predict_streaming_async(
+                prompt, **self.parameters
+            )
+        elif "gemini-" in self.model:
+            responses = await self.llm_endpoint.generate_content_async(
+                prompt, generation_config=self.parameters, stream=True
+            )
+
+        async for response in responses:
+            yield response
+
 
 class MyChatModel:
     """Vertex Language Model Class.
 
+    The text history of the conversation can be exported with get_history() and passed as history to
+    continue the conversation in another instance, e.g. after a restart. With a history_policy the history
+    is compacted before a turn when it grows over the policy's token budget, see ChatHistoryPolicy.
+
     Attributes:
         model: model name
         parameters: The parameters used for the model.
         llm_endpoint: The endpoint for the model.
     """
 
-    def __init__(self, model: str, parameters: Dict[str, str] = None):
+    def __init__(
+        self,
+        model: str,
+        parameters: Dict[str, str] = None,
+        history: List[Dict[str, str]] = None,
+        history_policy: ChatHistoryPolicy = None,
+        call_policy: CallPolicy = None,
+    ):
         """Generate text based on prompt.
 
         Args:
         model: model name
         parameters: The parameters used for the model.
+        history: Messages to start the conversation with, as returned by get_history()
+        history_policy: Policy compacting the history before each turn. Default is None, i.e. the full
+            history is sent.
+        call_policy: Retries and deadline of chat turns, which are never hedged. Default is the shared
+            policy of the model configured in Config.CALL_POLICIES.
 
         """
 
         self.parameters = parameters
         self.model = model
+        self.history_policy = history_policy
+        self.call_policy = call_policy or get_call_policy("MyChatModel", model)
+
+        # The model is shared through the model registry, the chat session belongs to this instance
+        self.chat_model = MODELS.get_or_create(
+            model_key("MyChatModel", model), lambda: self._create_chat_model(model)
+        )
+        self.chat_session = self._start_chat(history)
+
+    @staticmethod
+    def _create_chat_model(model: str):
+        """Create the chat model.
+
+        Args:
+        model: model name
 
+        Returns:
+        Chat model.
+        """
         if "chat-bison" in model:
-            self.chat_model = ChatModel.from_pretrained(model)
+            return language_models.ChatModel.from_pretrained(model)
         elif "codechat-" in model:
-            self.chat_model = CodeChatModel.from_pretrained(model)
+            return language_models.CodeChatModel.from_pretrained(model)
         elif "gemini-" in model:
-            self.chat_model = GenerativeModel(model)
-        else:
-            # Log request for debugging
-            logger.error(f"{model} not supported.")
-            raise ValueError(f"{model} not supported.")
-        self.chat_session = self.chat_model.start_chat()
+            return generative_models.GenerativeModel(model)
+
+        # Log request for debugging
+        logger.error("%s not supported.", model)
+        raise ValueError(f"{model} not supported.")
+
+    def _start_chat(self, history: List[Dict[str, str]] = None):
+        """Start a chat session.
+
+        Args:
+        history: Messages to start the conversation with, as returned by get_history()
+
+        Returns:
+        Chat session.
+        """
+        if not history:
+            return self.chat_model.start_chat()
+
+        if "gemini-" in self.model:
+            contents = [
+                generative_models.Content(
+                    role=message["role"],
+                    parts=[generative_models.Part.from_text(message["text"])],
+                )
+                for message in history
+            ]
+            return self.chat_model.start_chat(history=contents)
+
+        messages = [
+            language_models.ChatMessage(
+                content=message["text"],
+                author="bot" if message["role"] == "model" else "user",
+            )
+            for message in history
+        ]
+        return self.chat_model.start_chat(message_history=messages)
+
+    def get_history(self) -> List[Dict[str, str]]:
+        """Text history of the conversation.
+
+        Returns:
+        List of messages: {"role": "user" or "model", "text": message text}.
+        """
+        if "gemini-" in self.model:
+            return [
+                {
+                    "role": content.role,
+                    "text": "".join(_part_text(part) for part in content.parts),
+                }
+                for content in self.chat_session.history
+            ]
+
+        return [
+            {
+                "role": "model" if message.author == "bot" else "user",
+                "text": message.content,
+            }
+            for message in self.chat_session.message_history
+        ]
 
     def get_chat_response(self, prompt: str) -> str:
+        if self.history_policy is not None:
+            history = self.history_policy.apply(self.get_history(), self.model)
+            if history is not None:
+                # Chat sessions cannot drop messages, continue in a new one
+                self.chat_session = self._start_chat(history)
+
+        # Stateful: never hedged (the message would be added twice) nor abandoned after the deadline
+        return self.call_policy.call(self._send_message, prompt, stateful=True)
+
+    @instrument("MyChatModel", "get_chat_response")
+    def _send_message(self, prompt: str) -> str:
         response = self.chat_session.send_message(prompt)
         return response.text
+
+
+def _part_text(part) -> str:
+    # Function calls and responses have no text
+    try:
+        return part.text
+    except (AttributeError, ValueError):
+        return ""
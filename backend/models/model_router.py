@@ -0,0 +1,245 @@
+# Latency-aware routing of text generation between models
+
+import collections
+import copy
+import threading
+import time
+from typing import Dict, List, Union
+
+from backend.models.language import TextModel
+from backend.utils.utils_retry import CallPolicy, DeadlineExceeded, is_retryable
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+
+# Create logger object
+logger = Logger(__name__)
+
+MODEL_ROUTER_REQUESTS = REGISTRY.counter(
+    "model_router_requests",
+    "Requests sent by the model router by model and outcome",
+    ("router", "model", "outcome"),
+)
+MODEL_ROUTER_FALLBACKS = REGISTRY.counter(
+    "model_router_fallbacks",
+    "Requests which failed on a model and were retried on the next one",
+    ("router", "model"),
+)
+
+
+def _model_error(error: Exception) -> bool:
+    """Whether an error is caused by the model (unavailable, overloaded, too slow) rather than the request"""
+    return isinstance(error, DeadlineExceeded) or is_retryable(error)
+
+
+class _ModelStats:
+    """Latency and errors of the recent calls of a model"""
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.calls = collections.deque()
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self.lock:
+            self.calls.append((time.monotonic(), latency, ok))
+            self._expire()
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.window
+        while self.calls and self.calls[0][0] < deadline:
+            self.calls.popleft()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            self._expire()
+            calls = list(self.calls)
+        latencies = sorted(latency for _, latency, ok in calls if ok)
+        errors = sum(1 for _, _, ok in calls if not ok)
+        p95 = (
+            latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            if latencies
+            else None
+        )
+        return {
+            "calls": len(calls),
+            "error_rate": errors / len(calls) if calls else 0.0,
+            "p95": p95,
+        }
+
+
+class TextModelRouter:
+    """
+    Sends each request to the first healthy model of an ordered list of candidates and falls back to the
+    next one when a call fails.
+
+    A model is healthy while, over the last `window` seconds, its error rate is at most max_error_rate and
+    its p95 latency is within latency_slo. Models with fewer than min_samples recent calls are considered
+    healthy, so a degraded model gets traffic again once its bad calls leave the window. When no model is
+    healthy, models are tried by increasing error rate and p95 latency.
+
+    Only transient errors (see utils_retry.is_retryable) and deadlines count against a model and fall back to
+    the next one. Other errors, e.g. an invalid prompt, are raised at once.
+
+    Candidates are called without retries and with a deadline of attempt_timeout seconds, so the first
+    transient error or slow answer moves on to the next model instead of retrying the degraded one.
+
+    Example:
+        router = TextModelRouter(["gemini-1.5-flash-001", "gemini-1.5-pro-001"], latency_slo=5)
+        text = router.predict(prompt)
+    """
+
+    def __init__(
+        self,
+        models: List[Union[str, TextModel]],
+        parameters: Dict[str, str] = {"temperature": 0.5},
+        latency_slo: float = None,
+        max_error_rate: float = 0.2,
+        window: float = 60,
+        min_samples: int = 10,
+        name: str = "TextModelRouter",
+        attempt_timeout: float = None,
+    ) -> None:
+        """Initializer
+
+        Args:
+            models: Candidate models in order of preference, names or TextModel instances
+            parameters: The parameters of the models created from names
+            latency_slo: p95 latency in seconds above which a model is degraded. Default is None, i.e. only
+                errors make a model degraded.
+            max_error_rate: Error rate above which a model is degraded
+            window: Seconds of recent calls the latency and error rate are computed from
+            min_samples: Number of recent calls needed to consider a model degraded
+            name: Router name used in metrics
+            attempt_timeout: Seconds to wait for each model before falling back. Default is latency_slo.
+        """
+        if not models:
+            raise ValueError("TextModelRouter needs at least one model.")
+
+        if attempt_timeout is None:
+            attempt_timeout = latency_slo
+
+        # Copies of the candidates calling their model once, TextModel instances given by the caller keep
+        # their own call policy
+        self.models = []
+        for model in models:
+            if not isinstance(model, TextModel):
+                model = TextModel(model, parameters)
+            model = copy.copy(model)
+            model.call_policy = CallPolicy(
+                f"{name}:{model.model}", retries=0, deadline=attempt_timeout
+            )
+            self.models.append(model)
+        self.latency_slo = latency_slo
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.name = name
+        self._stats = {id(model): _ModelStats(window) for model in self.models}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Recent latency and errors of the candidates.
+
+        Returns:
+            Calls, error rate, p95 latency and health by model name
+        """
+        stats = {}
+        for model in self.models:
+            snapshot = self._stats[id(model)].snapshot()
+            snapshot["healthy"] = self._healthy(snapshot)
+            stats[model.model] = snapshot
+        return stats
+
+    def _healthy(self, snapshot: Dict[str, float]) -> bool:
+        if snapshot["calls"] < self.min_samples:
+            return True
+        if snapshot["error_rate"] > self.max_error_rate:
+            return False
+        return (
+            self.latency_slo is None
+            or snapshot["p95"] is None
+            or snapshot["p95"] <= self.latency_slo
+        )
+
+    def ranking(self) -> List[TextModel]:
+        """Order in which the candidates are tried for the next request.
+
+        Returns:
+            Healthy models in order of preference, then degraded ones from the least to the most degraded
+        """
+        healthy, degraded = [], []
+        for model in self.models:
+            snapshot = self._stats[id(model)].snapshot()
+            if self._healthy(snapshot):
+                healthy.append(model)
+            else:
+                degraded.append((snapshot["error_rate"], snapshot["p95"] or 0, model))
+        degraded.sort(key=lambda entry: entry[:2])
+        return healthy + [model for _, _, model in degraded]
+
+    def _record(self, model: TextModel, start: float, error: Exception) -> None:
+        self._stats[id(model)].record(time.monotonic() - start, error is None)
+        MODEL_ROUTER_REQUESTS.inc(
+            router=self.name,
+            model=model.model,
+            outcome="success" if error is None else "error",
+        )
+        if error is not None:
+            MODEL_ROUTER_FALLBACKS.inc(router=self.name, model=model.model)
+            logger.warning("%s failed on %s: %s", self.name, model.model, error)
+
+    def predict(self, prompt: str) -> str:
+        """Generate text on the best healthy model, falling back to the next ones when it fails.
+
+        Args:
+            prompt: Prompt
+
+        Returns:
+            Generated Text
+
+        Raises:
+            Exception: A non transient error, or the error of the last model when all models failed
+        """
+        error = None
+        for model in self.ranking():
+            start = time.monotonic()
+            try:
+                text = model.predict(prompt)
+            except Exception as e:
+                if not _model_error(e):
+                    # Client errors (invalid prompt, token budget, safety block) fail on every model
+                    raise
+                error = e
+                self._record(model, start, e)
+                continue
+            self._record(model, start, None)
+            return text
+        raise error
+
+    async def apredict(self, prompt: str, timeout: float = None) -> str:
+        """Generate text on the best healthy model without blocking the event loop, falling back to the
+        next ones when it fails.
+
+        Args:
+            prompt: Prompt
+            timeout: Seconds to wait for each model. Default is the deadline of the model's call policy.
+
+        Returns:
+            Generated Text
+
+        Raises:
+            Exception: A non transient error, or the error of the last model when all models failed
+        """
+        error = None
+        for model in self.ranking():
+            start = time.monotonic()
+            try:
+                text = await model.apredict(prompt, timeout)
+            except Exception as e:
+                if not _model_error(e):
+                    # Client errors (invalid prompt, token budget, safety block) fail on every model
+                    raise
+                error = e
+                self._record(model, start, e)
+                continue
+            self._record(model, start, None)
+            return text
+        raise error
@@ -1,13 +1,23 @@
-import base64
-from typing import Dict
-from vertexai.generative_models import GenerativeModel, Part
-from vertexai.preview import generative_models
+from typing import AsyncIterator, Dict, Iterator, Union
 
+from backend.models.registry import MODELS, model_key
+from backend.models.streaming import AsyncTextStream, TextStream
+from backend.utils.utils_image import to_image_bytes
+from backend.utils.utils_lazy import lazy_import
+from backend.utils.utils_retry import CallPolicy, get_call_policy
 from logger.logging import Logger
+from metrics.metrics import instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+# Vertex AI SDK modules, imported on first use
+generative_models = lazy_import("vertexai.generative_models")
+preview_generative_models = lazy_import("vertexai.preview.generative_models")
+
+# Image input: raw bytes (e.g. an uploaded file), bytearray, memoryview, or base64 string or bytes
+ImageInput = Union[str, bytes, bytearray, memoryview]
+
 
 class MultiModel:
     """
@@ -18,45 +28,107 @@ class MultiModel:
         self,
         model: str,
         generation_config: Dict[str, str] = None,
+        call_policy: CallPolicy = None,
     ):
         """Generate text based on prompt.
 
         Args:
         model: model name
         parameters: The parameters used for the model.
+        call_policy: Retries, deadline and hedging of model calls. Default is the shared policy of the
+            model configured in Config.CALL_POLICIES.
 
         """
 
         self.generation_config = generation_config
-        self.model_endpoint = GenerativeModel(model)
+        self.call_policy = call_policy or get_call_policy("MultiModel", model)
+        self.model_endpoint = MODELS.get_or_create(
+            model_key("GenerativeModel", model),
+            lambda: generative_models.GenerativeModel(model),
+        )
+        harm_category = preview_generative_models.HarmCategory
+        block_threshold = preview_generative_models.HarmBlockThreshold
         self.safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            harm_category.HARM_CATEGORY_HATE_SPEECH: block_threshold.BLOCK_MEDIUM_AND_ABOVE,
+            harm_category.HARM_CATEGORY_DANGEROUS_CONTENT: block_threshold.BLOCK_MEDIUM_AND_ABOVE,
+            harm_category.HARM_CATEGORY_SEXUALLY_EXPLICIT: block_threshold.BLOCK_MEDIUM_AND_ABOVE,
+            harm_category.HARM_CATEGORY_HARASSMENT: block_threshold.BLOCK_MEDIUM_AND_ABOVE,
         }
         logger.info("Intialized Multimodel Gemini Instance")
 
-    def predict(self, prompt: str, image_bytes: str) -> str:
+    def predict(self, prompt: str, image_bytes: ImageInput) -> str:
         """Predict Method
 
         Args:
             prompt (str): User text input
-            image_bytes (str): Image Input in bytes
+            image_bytes (ImageInput): Image Input, raw bytes or base64 string/bytes
 
         Returns:
             str: Generated Text Response from the model
         """
 
-        image1 = Part.from_data(
-            mime_type="image/png", data=base64.b64decode(image_bytes)
+        response = self.call_policy.call(
+            self._generate, self._contents(prompt, image_bytes)
         )
+        logger.debug("Prediction Response: %s", response, event="model_response")
+        return response.text
 
-        response = self.model_endpoint.generate_content(
-            [prompt, image1],
+    @instrument("MultiModel", "predict")
+    def _generate(self, contents: list):
+        return self.model_endpoint.generate_content(
+            contents,
             generation_config=self.generation_config,
             safety_settings=self.safety_settings,
             stream=False,
         )
-        logger.debug(f"Prediction Response: {response}")
-        return response.text
+
+    def predict_stream(self, prompt: str, image_bytes: ImageInput) -> TextStream:
+        """Streaming Predict Method
+
+        Args:
+            prompt (str): User text input
+            image_bytes (ImageInput): Image Input, raw bytes or base64 string/bytes
+
+        Returns:
+            TextStream: Generated Text Response chunks as they are generated, with usage_metadata once exhausted
+        """
+        return TextStream(self._stream(prompt, image_bytes))
+
+    def apredict_stream(self, prompt: str, image_bytes: ImageInput) -> AsyncTextStream:
+        """Async Streaming Predict Method, does not block the event loop
+
+        Args:
+            prompt (str): User text input
+            image_bytes (ImageInput): Image Input, raw bytes or base64 string/bytes
+
+        Returns:
+            AsyncTextStream: Generated Text Response chunks as they are generated, with usage_metadata once
+            exhausted
+        """
+        return AsyncTextStream(self._astream(prompt, image_bytes))
+
+    def _contents(self, prompt: str, image_bytes: ImageInput) -> list:
+        image1 = generative_models.Part.from_data(
+            mime_type="image/png", data=to_image_bytes(image_bytes)
+        )
+        return [prompt, image1]
+
+    @instrument("MultiModel", "predict_stream")
+    def _stream(self, prompt: str, image_bytes: ImageInput) -> Iterator:
+        yield from self.model_endpoint.generate_content(
+            self._contents(prompt, image_bytes),
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings,
+            stream=True,
+        )
+
+    @instrument("MultiModel", "apredict_stream")
+    async def _astream(self, prompt: str, image_bytes: ImageInput) -> AsyncIterator:
+        responses = await self.model_endpoint.generate_content_async(
+            self._contents(prompt, image_bytes),
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings,
+            stream=True,
+        )
+        async for response in responses:
+            yield response
@@ -0,0 +1,140 @@
+# Process-wide registry of model endpoints
+
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from logger.logging import Logger
+from metrics.metrics import REGISTRY as METRICS
+
+# Create logger object
+logger = Logger(__name__)
+
+MODEL_REGISTRY_REQUESTS = METRICS.counter(
+    "model_registry_requests",
+    "Model endpoint lookups in the model registry by result (hit or miss)",
+    ("kind", "result"),
+)
+
+
+def _to_serializable(value: Any) -> Any:
+    # SDK objects (GenerationConfig, Tool, ...) expose to_dict(), fall back to repr for anything else
+    to_dict = getattr(value, "to_dict", None)
+    if callable(to_dict):
+        return to_dict()
+    return repr(value)
+
+
+def model_key(kind: str, model: str, config: Any = None, tools: Any = None) -> tuple:
+    """Build the registry key of a model endpoint.
+
+    Args:
+        kind: Kind of endpoint, e.g. "GenerativeModel" or "TextGenerationModel"
+        model: Model name
+        config: Generation config (dict or SDK object) or other options the endpoint is created with
+        tools: Tools the endpoint is created with
+
+    Returns:
+        Hashable key, equal for endpoints created with equal arguments
+    """
+    return (
+        kind,
+        model,
+        json.dumps(config, sort_keys=True, default=_to_serializable),
+        json.dumps(tools, sort_keys=True, default=_to_serializable),
+    )
+
+
+class ModelRegistry:
+    """
+    Creates each model endpoint once per process and returns the same instance afterwards, so request
+    handlers do not pay the construction cost (from_pretrained calls, client setup) on every request.
+
+    Model endpoints are stateless and safe to share between threads; stateful objects such as chat
+    sessions must still be created per conversation from the shared endpoint.
+
+    Example:
+        model = MODELS.get_or_create(
+            model_key("GenerativeModel", "gemini-1.5-pro"),
+            lambda: generative_models.GenerativeModel("gemini-1.5-pro"),
+        )
+    """
+
+    def __init__(self) -> None:
+        self._models = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._override = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the model endpoint registered under key, creating it with factory on first use.
+
+        Concurrent first calls for the same key create the endpoint once, calls for other keys are not blocked.
+
+        Args:
+            key: Key built with model_key()
+            factory: Function creating the endpoint
+
+        Returns:
+            Model endpoint
+        """
+        kind = key[0] if isinstance(key, tuple) else str(key)
+
+        model = self._models.get(key)
+        if model is not None:
+            self.hits += 1
+            MODEL_REGISTRY_REQUESTS.inc(kind=kind, result="hit")
+            return model
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                MODEL_REGISTRY_REQUESTS.inc(kind=kind, result="hit")
+                return model
+
+            if self._override is not None:
+                model = self._override(key)
+            else:
+                model = factory()
+            self._models[key] = model
+            self.misses += 1
+            MODEL_REGISTRY_REQUESTS.inc(kind=kind, result="miss")
+            logger.info("Created model endpoint %s", key)
+
+        return model
+
+    def stats(self) -> Dict[str, int]:
+        """Registry statistics.
+
+        Returns:
+            Number of registered endpoints, hits and misses
+        """
+        return {"models": len(self._models), "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        """Forget all registered endpoints, e.g. after changing credentials."""
+        with self._lock:
+            self._models.clear()
+            self._locks.clear()
+
+    def override(self, factory: Callable[[Hashable], Any]) -> None:
+        """Create all endpoints with factory instead of their own factory, e.g. to serve them from fakes.
+
+        Endpoints already registered are dropped.
+
+        Args:
+            factory: Function creating the endpoint of a key, None to restore the endpoints' own factories
+        """
+        with self._lock:
+            self._override = factory
+        self.clear()
+
+
+# Registry shared by all models of the process
+MODELS = ModelRegistry()
@@ -1,9 +1,13 @@
-from google.cloud import texttospeech, speech
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
 
 # Create logger object
 logger = Logger(__name__)
 
+# Cloud Speech SDK modules, imported on first use
+texttospeech = lazy_import("google.cloud.texttospeech")
+speech = lazy_import("google.cloud.speech")
+
 
 class TexttoSpeech:
     def __init__(self, project_id: str, location: str = "us-central1") -> None:
@@ -0,0 +1,141 @@
+# Streams of generated text
+
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+# Token counts reported by Gemini responses
+USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "total_token_count")
+
+
+def _chunk_text(response) -> str:
+    """Text of a streamed response chunk.
+
+    Args:
+        response: GenerationResponse or TextGenerationResponse chunk
+
+    Returns:
+        Text of the chunk, empty for chunks without text (e.g. the final chunk carrying only usage metadata)
+    """
+    try:
+        return response.text
+    except (ValueError, AttributeError, IndexError):
+        return ""
+
+
+def _chunk_usage(response) -> Optional[Dict[str, int]]:
+    """Usage metadata of a streamed response chunk.
+
+    Args:
+        response: GenerationResponse or TextGenerationResponse chunk
+
+    Returns:
+        Token counts, or None when the chunk does not report usage
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    return {field: getattr(usage, field, 0) for field in USAGE_FIELDS}
+
+
+class TextStream:
+    """
+    Iterator of the text chunks of a streamed generation.
+
+    Once the stream is exhausted, text holds the full generated text and usage_metadata the token counts
+    of the generation (None for models which do not report them).
+
+    Example:
+        stream = model.predict_stream(prompt)
+        for chunk in stream:
+            print(chunk, end="")
+        print(stream.usage_metadata)
+    """
+
+    def __init__(self, responses: Iterator) -> None:
+        """Initializer
+
+        Args:
+            responses: Iterator of SDK response chunks
+        """
+        self._responses = responses
+        self._chunks = []
+        self.usage_metadata = None
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        """Text generated so far"""
+        return "".join(self._chunks)
+
+    def _update(self, response) -> str:
+        text = _chunk_text(response)
+        if text:
+            self._chunks.append(text)
+        usage = _chunk_usage(response)
+        if usage:
+            self.usage_metadata = usage
+        return text
+
+    def __iter__(self) -> "TextStream":
+        return self
+
+    def __next__(self) -> str:
+        # Chunks without text only update usage_metadata
+        text = ""
+        while not text:
+            try:
+                response = next(self._responses)
+            except StopIteration:
+                self.done = True
+                raise
+            text = self._update(response)
+        return text
+
+    def close(self) -> None:
+        """Stop the generation, e.g. when the client disconnected."""
+        close = getattr(self._responses, "close", None)
+        if close is not None:
+            close()
+
+
+class AsyncTextStream(TextStream):
+    """
+    Async iterator of the text chunks of a streamed generation, see TextStream.
+
+    Example:
+        stream = model.apredict_stream(prompt)
+        async for chunk in stream:
+            ...
+        print(stream.usage_metadata)
+    """
+
+    def __init__(self, responses: AsyncIterator) -> None:
+        """Initializer
+
+        Args:
+            responses: Async iterator of SDK response chunks
+        """
+        super().__init__(responses)
+
+    def __iter__(self):
+        raise TypeError("AsyncTextStream is iterated with async for")
+
+    def __aiter__(self) -> "AsyncTextStream":
+        return self
+
+    async def __anext__(self) -> str:
+        # Chunks without text only update usage_metadata
+        text = ""
+        while not text:
+            try:
+                response = await self._responses.__anext__()
+            except StopAsyncIteration:
+                self.done = True
+                raise
+            text = self._update(response)
+        return text
+
+    async def aclose(self) -> None:
+        """Stop the generation, e.g. when the client disconnected."""
+        aclose = getattr(self._responses, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -1,12 +1,18 @@
-import base64
-from vertexai.preview.vision_models import ImageGenerationModel
-from vertexai.vision_models import Image
+from typing import Union
 
+from backend.models.registry import MODELS, model_key
+from backend.utils.utils_image import to_image_bytes
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
+from metrics.metrics import instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+# Vertex AI SDK modules, imported on first use
+preview_vision_models = lazy_import("vertexai.preview.vision_models")
+vision_models = lazy_import("vertexai.vision_models")
+
 
 class ImageModel:
     """Image Model Class"""
@@ -16,8 +22,12 @@ class ImageModel:
         model: str,
     ) -> None:
         # Image models
-        self.imagen = ImageGenerationModel.from_pretrained(model)
+        self.imagen = MODELS.get_or_create(
+            model_key("ImageGenerationModel", model),
+            lambda: preview_vision_models.ImageGenerationModel.from_pretrained(model),
+        )
 
+    @instrument("ImageModel")
     def generate_image(
         self, prompt: str, number_of_images: int, negative_prompt: str = None
     ):
@@ -39,7 +49,7 @@ class ImageModel:
                 negative_prompt=negative_prompt,
             )
         except Exception as e:
-            logger.error(f"Exception Occurred: {str(e)}.")
+            logger.error("Exception Occurred: %s.", e)
 
         else:
             generated_images = []
@@ -57,19 +67,20 @@ class ImageModel:
 
         return generated_images
 
+    @instrument("ImageModel")
     def edit_image(
         self,
         prompt: str,
-        base_image_base64: str,
-        mask_base64: str = None,
+        base_image_base64: Union[str, bytes, bytearray, memoryview],
+        mask_base64: Union[str, bytes, bytearray, memoryview] = None,
         number_of_images: int = 1,
         negative_prompt: str = None,
     ):
         """Image editing with Imagen
         Parameters:
             prompt: str
-            base_image_base64: str
-            mask_base64: str | None = None
+            base_image_base64: str | bytes | bytearray | memoryview, base64 string/bytes or raw bytes
+            mask_base64: str | bytes | bytearray | memoryview | None = None, base64 string/bytes or raw bytes
             number_of_images: int = 1
             negative_prompt: str = None
         Returns:
@@ -82,18 +93,20 @@ class ImageModel:
         if not mask_base64:
             mask = None
         else:
-            mask = Image(image_bytes=base64.b64decode(mask_base64))
+            mask = vision_models.Image(image_bytes=to_image_bytes(mask_base64))
 
         try:
             imagen_responses = self.imagen.edit_image(
                 prompt=prompt,
-                base_image=Image(image_bytes=base64.b64decode(base_image_base64)),
+                base_image=vision_models.Image(
+                    image_bytes=to_image_bytes(base_image_base64)
+                ),
                 mask=mask,
                 number_of_images=number_of_images,
                 negative_prompt=negative_prompt,
             )
         except Exception as e:
-            logger.error(f"Exception Occurred: {str(e)}.")
+            logger.error("Exception Occurred: %s.", e)
         else:
             generated_images = []
             i = 0
@@ -1,9 +1,15 @@
-from google.cloud import bigquery
+from __future__ import annotations
+
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
+from metrics.metrics import instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+# BigQuery SDK module, imported on first use
+bigquery = lazy_import("google.cloud.bigquery")
+
 
 class BigQueryConnector:
     """
@@ -19,14 +25,16 @@ class BigQueryConnector:
         return self.__gcp_project_id
 
     @property
-    def bq_client(self) -> bigquery.Client():
+    def bq_client(self) -> bigquery.Client:
         return bigquery.Client(project=self.gcp_project_id)
 
+    @instrument("BigQueryConnector")
     def execute_query(self, sql):
         job = self.bq_client.query(sql)
         result = job.to_dataframe().to_json(orient="records")
         return result
 
+    @instrument("BigQueryConnector")
     def write_to_bq(self, data: dict, dataset_id: str, table_id: str):
         """
         Writes a dictionary of data into a BigQuery table.
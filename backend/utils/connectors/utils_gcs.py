@@ -1,9 +1,13 @@
-from google.cloud import storage
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
+from metrics.metrics import instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+# Cloud Storage SDK module, imported on first use
+storage = lazy_import("google.cloud.storage")
+
 
 class GCSConnector:
     """
@@ -27,11 +31,13 @@ class GCSConnector:
     def get_gcs_client(self):
         return storage.Client(project=self.gcp_project_id)
 
+    @instrument("GCSConnector")
     def read_text(self, file_path: str) -> str:
         gcp_resp = self.get_gcs_client().get_bucket(self.bucket_name).blob(file_path)
         text_data: str = gcp_resp.download_as_string().decode("utf-8")
         return text_data
 
+    @instrument("GCSConnector")
     def write_text(self, data: str, file_path: str) -> None:
         self.get_gcs_client().get_bucket(self.bucket_name).blob(
             file_path,
@@ -1,4 +1,8 @@
-from google.cloud import secretmanager
+from backend.utils.utils_lazy import lazy_import
+from metrics.metrics import instrument
+
+# Secret Manager SDK module, imported on first use
+secretmanager = lazy_import("google.cloud.secretmanager")
 
 
 class SecretManagerConnector:
@@ -16,6 +20,7 @@ class SecretManagerConnector:
         self.project_id = project_id
         self._client = secretmanager.SecretManagerServiceClient()
 
+    @instrument("SecretManagerConnector")
     def create_secret(self, secret_id, secret_value):
         """
         Creates a new secret in Secret Manager.
@@ -35,6 +40,7 @@ class SecretManagerConnector:
         )
         print(f"Created secret: {response.name}")
 
+    @instrument("SecretManagerConnector")
     def add_secret_version(self, secret_id, secret_value):
         """
         Adds a new version to an existing secret.
@@ -51,6 +57,7 @@ class SecretManagerConnector:
         )
         print(f"Added secret version: {response.name}")
 
+    @instrument("SecretManagerConnector")
     def access_secret_version(self, secret_id, version_id="latest"):
         """
         Retrieves the value of a secret version.
@@ -1,18 +1,21 @@
 # Utility Module for GenAI Agent
 
 from abc import ABC, abstractmethod
-from vertexai.generative_models import (
-    FunctionDeclaration,
-    GenerativeModel,
-    Part,
-    Tool,
-)
 
+from backend.models.registry import MODELS, model_key
+from backend.utils.utils_lazy import lazy_import
+from backend.utils.utils_retry import get_call_policy
 from logger.logging import Logger
 
 # Create logger object
 logger = Logger(__name__)
 
+# Vertex AI SDK modules, imported on first use
+generative_models = lazy_import("vertexai.generative_models")
+
+# Generation config of agent predictions
+AGENT_GENERATION_CONFIG = {"temperature": 0}
+
 
 class BaseAgent(ABC):
     """
@@ -36,7 +39,10 @@ class BaseAgent(ABC):
                     function["name"], function["description"], function["parameters"]
                 )
             )
-        self.tools = Tool(function_declarations=self.function_declarations)
+        self.tools = generative_models.Tool(
+            function_declarations=self.function_declarations
+        )
+        self.call_policy = get_call_policy("BaseAgent")
 
     def add_function_declaration(self, name, description, parameters):
         """Method to add Function Declaration
@@ -49,7 +55,7 @@ class BaseAgent(ABC):
         Returns:
             _type_: FunctionDeclaration object
         """
-        function_declaration = FunctionDeclaration(
+        function_declaration = generative_models.FunctionDeclaration(
             name=name,
             description=description,
             parameters=parameters,
@@ -65,13 +71,24 @@ class BaseAgent(ABC):
         Returns:
             dict: model response
         """
-        self.model = GenerativeModel(model_name)
-        response = self.model.generate_content(
+        model = MODELS.get_or_create(
+            model_key("GenerativeModel", model_name),
+            lambda: generative_models.GenerativeModel(model_name),
+        )
+        # Kept for subclasses reading it. The request uses the local model, so concurrent predictions with
+        # other models do not interfere.
+        self.model = model
+        response = get_call_policy("BaseAgent", model_name).call(
+            self._generate_content, model, prompt
+        )
+        return response
+
+    def _generate_content(self, model, prompt):
+        return model.generate_content(
             prompt,
-            generation_config={"temperature": 0},
+            generation_config=AGENT_GENERATION_CONFIG,
             tools=[self.tools],
         )
-        return response
 
     def get_chat_session(self, model_name="gemini-1.5-pro"):
         """Create chat sessions
@@ -79,10 +96,21 @@ class BaseAgent(ABC):
         Returns:
             chat_session: chat session object
         """
-        model = GenerativeModel(
-            model_name, generation_config={"temperature": 0}, tools=[self.tools]
+        model = MODELS.get_or_create(
+            model_key(
+                "GenerativeModel",
+                model_name,
+                AGENT_GENERATION_CONFIG,
+                self.function_declarations,
+            ),
+            lambda: generative_models.GenerativeModel(
+                model_name,
+                generation_config=AGENT_GENERATION_CONFIG,
+                tools=[self.tools],
+            ),
         )
         self.chat_session = model.start_chat()
+        self.call_policy = get_call_policy("BaseAgent", model_name)
         return self.chat_session
 
     def run(self, prompt):
@@ -94,7 +122,11 @@ class BaseAgent(ABC):
         self.prompt = prompt
         # Step 2: Prompt Gemini to get function call
 
-        response = self.chat_session.send_message(prompt)
+        # Chat turns are retried but never hedged nor abandoned, they run in this thread so a turn which timed
+        # out was not added to the history
+        response = self.call_policy.call(
+            self.chat_session.send_message, prompt, stateful=True
+        )
         response = response.candidates[0].content.parts[0]
 
         # Step 3: Call Agent
@@ -107,20 +139,22 @@ class BaseAgent(ABC):
                     params[key] = value
 
                 logger.debug(
-                    f"[Agent] Predicted Funtion Call: {response.function_call.name}"
+                    "[Agent] Predicted Funtion Call: %s", response.function_call.name
                 )
 
                 func_response = self._call_function(response.function_call.name, params)
 
-                logger.debug(f"[Agent] Function Response: {func_response}")
+                logger.debug("[Agent] Function Response: %s", func_response)
 
-                response = self.chat_session.send_message(
-                    Part.from_function_response(
+                response = self.call_policy.call(
+                    self.chat_session.send_message,
+                    generative_models.Part.from_function_response(
                         name=response.function_call.name,
                         response={
                             "content": func_response,
                         },
                     ),
+                    stateful=True,
                 )
                 response = response.candidates[0].content.parts[0]
 
@@ -0,0 +1,123 @@
+# Utility Module for batch processing with bounded concurrency
+
+import collections
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+from backend.utils.utils_retry import is_retryable
+from logger.logging import Logger
+
+# Create logger object
+logger = Logger(__name__)
+
+
+def call_with_retries(
+    func: Callable, item: Any, retries: int = 2, backoff: float = 1.0
+) -> Any:
+    """Call func(item), retrying transient failures (see utils_retry.is_retryable) with exponential backoff
+    and jitter. Other errors, e.g. invalid arguments, are raised at once.
+
+    Args:
+        func: Function to call
+        item: Argument of the function
+        retries: Number of retries after the first attempt
+        backoff: Seconds to wait before the first retry, doubled for every further retry
+
+    Returns:
+        Result of the call
+
+    Raises:
+        Exception: The exception of the last attempt
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(item)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.warning(
+                "Attempt %s failed, retrying in %.1fs: %s", attempt, delay, e
+            )
+            time.sleep(delay)
+
+
+def map_bounded(
+    func: Callable,
+    items: Iterable,
+    concurrency: int = 8,
+    retries: int = 2,
+    backoff: float = 1.0,
+    ordered: bool = True,
+    return_exceptions: bool = True,
+) -> Iterator[Tuple[int, Any]]:
+    """Apply func to every item with at most `concurrency` calls in flight.
+
+    Items are read lazily and results are yielded as soon as they are available, so memory use does not
+    depend on the number of items: at most 2 * concurrency items are held at a time.
+
+    Example:
+        for index, response in map_bounded(fetch, urls, concurrency=16):
+            ...
+
+    Args:
+        func: Function called with each item, run in a thread pool
+        items: Iterable of items, e.g. a generator reading a file
+        concurrency: Maximum number of concurrent calls
+        retries: Number of retries of a call which failed with a transient error. Use 0 when func already
+            retries, e.g. model methods going through a CallPolicy.
+        backoff: Seconds to wait before the first retry of a call, doubled for every further retry
+        ordered: Yield results in input order. When False results are yielded as they complete.
+        return_exceptions: Yield the exception of an item which failed all attempts instead of raising it
+
+    Returns:
+        Iterator of (index of the item, result or exception) tuples
+    """
+    window = 2 * concurrency
+    items = enumerate(items)
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+
+    def submit() -> bool:
+        try:
+            index, item = next(items)
+        except StopIteration:
+            return False
+        future = executor.submit(call_with_retries, func, item, retries, backoff)
+        future.index = index
+        pending.append(future)
+        return True
+
+    def result(future) -> Tuple[int, Any]:
+        error = future.exception()
+        if error is None:
+            return future.index, future.result()
+        logger.error("Item %s failed: %s.", future.index, error)
+        if not return_exceptions:
+            raise error
+        return future.index, error
+
+    try:
+        while len(pending) < window and submit():
+            pass
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                submit()
+                yield result(future)
+    finally:
+        # Also reached when the caller stops iterating early: drop the queued calls
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,16 +1,41 @@
 """Cache Content Helper Module"""
 
+from __future__ import annotations
+
 import datetime
-from vertexai.preview.generative_models import GenerativeModel, Part
-from vertexai.preview import caching
+import hashlib
+import json
+from typing import TYPE_CHECKING
+
+from backend.models.registry import MODELS, model_key
+from backend.utils.utils_lazy import lazy_import
+from backend.utils.utils_retry import get_call_policy
+from backend.utils.utils_tokens import (
+    TOKEN_COUNTER,
+    TokenBudgetExceeded,
+    estimate_tokens,
+)
 from logger.logging import Logger
 from config import Config
 
+if TYPE_CHECKING:
+    from vertexai.preview.generative_models import Part
+
 logger = Logger(__name__)
 
+# Vertex AI SDK modules, imported on first use
+generative_models = lazy_import("vertexai.preview.generative_models")
+caching = lazy_import("vertexai.preview.caching")
+
 
 class GeminiContentCache:
-    """cached content object"""
+    """cached content object
+
+    With max_tokens, the documents and prompt are checked against the token budget before the cache is
+    created or prompted, and TokenBudgetExceeded is raised when they are over it. Documents are not trimmed,
+    as PDFs and images cannot be cut. Token counts of documents are cached by document names, so documents
+    reused across prompts are counted once.
+    """
 
     def __init__(
         self,
@@ -18,8 +43,10 @@ class GeminiContentCache:
         system_instruction: str = None,
         cache_id: str = None,
         ttl_minutes: int = 60,
+        max_tokens: int = None,
     ) -> None:
         self.model_name = model_name
+        self.max_tokens = max_tokens
         self.system_instruction = system_instruction
         if self.system_instruction is None:
             self.system_instruction = Config.DEFAULT_SYSTEM_INSTRUCTION
@@ -43,10 +70,31 @@ class GeminiContentCache:
             raise ValueError("missing cache_id")
         cached_content = caching.CachedContent(cached_content_name=self.cache_id)
 
-        model = GenerativeModel.from_cached_content(cached_content=cached_content)
-        response = model.generate_content(prompt)
+        model = generative_models.GenerativeModel.from_cached_content(
+            cached_content=cached_content
+        )
+        response = get_call_policy("GeminiContentCache", self.model_name).call(
+            model.generate_content, prompt
+        )
         return response.text
 
+    def count_doc_tokens(self, doc_names: list[str], contents: list[Part]) -> int:
+        """exact token count of docs contents, cached by doc_names and a hash of the contents,
+        so a doc changed under the same name is counted again"""
+        model = MODELS.get_or_create(
+            model_key("GenerativeModel", self.model_name),
+            lambda: generative_models.GenerativeModel(self.model_name),
+        )
+        digest = hashlib.sha256()
+        for content in contents:
+            if isinstance(content, str):
+                digest.update(content.encode("utf-8"))
+            else:
+                digest.update(json.dumps(content.to_dict(), sort_keys=True).encode())
+            digest.update(b"\0")
+        key = "\0".join(sorted(doc_names) + [digest.hexdigest()])
+        return TOKEN_COUNTER.count(model, contents, key=key)
+
     def prompt_docs(
         self,
         prompt: str,
@@ -59,14 +107,25 @@ class GeminiContentCache:
         handles already cached data"""
         set_docs = frozenset(doc_names)
 
+        # Preflight: fail before a slow cache creation or prompt round trip
+        if self.max_tokens is not None and contents is not None:
+            tokens = self.count_doc_tokens(doc_names, contents) + estimate_tokens(
+                prompt
+            )
+            if tokens > self.max_tokens:
+                raise TokenBudgetExceeded(
+                    f"docs {sorted(set_docs)} and prompt have {tokens} tokens, over the {self.max_tokens} "
+                    "tokens budget"
+                )
+
         if doc_cache_id_map.get(set_docs):
             self.cache_id = doc_cache_id_map[set_docs]
         else:
-            logger.debug(f"Creating cache for docs {set_docs}")
+            logger.debug("Creating cache for docs %s", set_docs)
             self.cache_id = self.create_cached_content(contents)
             doc_cache_id_map[set_docs] = self.cache_id
-        logger.debug(f"docs {set_docs} cache id {self.cache_id}")
+        logger.debug("docs %s cache id %s", set_docs, self.cache_id)
 
         cache_response = self.prompt_cached_content(prompt)
-        logger.debug(f"cache_id {self.cache_id} response {cache_response}")
+        logger.debug("cache_id %s response %s", self.cache_id, cache_response)
         return cache_response
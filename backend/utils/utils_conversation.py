@@ -1,10 +1,14 @@
-from google.cloud import dialogflowcx_v3 as dialogflow
 import uuid
+
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
 
 # Create logger object
 logger = Logger(__name__)
 
+# Dialogflow CX SDK module, imported on first use
+dialogflow = lazy_import("google.cloud.dialogflowcx_v3")
+
 
 class DecoupledDialogflow:
     """
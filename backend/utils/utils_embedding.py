@@ -1,5 +1,9 @@
-from google.cloud import aiplatform
-from google.protobuf import struct_pb2
+from backend.utils.utils_lazy import lazy_import
+from metrics.metrics import instrument
+
+# Vertex AI SDK modules, imported on first use
+aiplatform = lazy_import("google.cloud.aiplatform")
+struct_pb2 = lazy_import("google.protobuf.struct_pb2")
 
 
 class GenerateEmbeddings:
@@ -12,6 +16,7 @@ class GenerateEmbeddings:
         self.PROJECT_ID = project_id
         self.LOCATION = location
 
+    @instrument("GenerateEmbeddings")
     def get_embedding(self, text: str = None, image_file: str = None):
         client = aiplatform.gapic.PredictionServiceClient(
             client_options={"api_endpoint": self.api_endpoint}
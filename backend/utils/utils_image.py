@@ -1,8 +1,39 @@
 # Image Helper Utilities
 
-from PIL import Image
 import base64
+import re
 from io import BytesIO
+from typing import Union
+
+from backend.utils.utils_lazy import lazy_import
+
+# Pillow, imported on first use
+Image = lazy_import("PIL.Image")
+
+# Base64 encoded data, possibly split in lines. Matching stops at the first byte outside the alphabet.
+_BASE64 = re.compile(rb"[A-Za-z0-9+/\r\n]*={0,2}[\r\n]*")
+
+
+def to_image_bytes(image: Union[str, bytes, bytearray, memoryview]) -> bytes:
+    """Raw bytes of an image
+
+    Base64 given as bytes (e.g. the output of base64.b64encode) is still decoded. Raw images are told apart
+    by their binary header (PNG, JPEG, GIF, WebP and other formats start with bytes outside the base64
+    alphabet within their first bytes), so they are recognized without scanning the whole image.
+
+    Args:
+        image: Image as raw bytes (returned as is, without a copy), bytearray, memoryview, or base64 string or
+            bytes
+
+    Returns:
+        bytes: Image bytes, as expected by the Vertex AI SDK
+    """
+    if isinstance(image, str) or _BASE64.fullmatch(image):
+        return base64.b64decode(image)
+    if isinstance(image, bytes):
+        return image
+    # The SDK's protobuf messages only hold bytes
+    return bytes(image)
 
 
 class Mask:
@@ -16,6 +47,7 @@ class Mask:
         mask_end_x: int,
         mask_start_y: int,
         mask_end_y: int,
+        as_bytes: bool = False,
     ):
         """Generate Image Mask
 
@@ -26,9 +58,10 @@ class Mask:
             mask_end_x (int): x end coordinate
             mask_start_y (int): y start coordinate
             mask_end_y (int): y end coordinate
+            as_bytes (bool): return the JPEG bytes instead of a base64 string
 
         Returns:
-            _type_: base64 masked image
+            str | bytes: base64 masked image, or its bytes with as_bytes
         """
         img = Image.new(mode="RGB", size=(width, height))
 
@@ -39,6 +72,8 @@ class Mask:
 
         buffered = BytesIO()
         img.save(buffered, format="JPEG")
+        if as_bytes:
+            return buffered.getvalue()
         img_str = base64.b64encode(buffered.getvalue())
 
         return str(img_str, encoding="utf-8")
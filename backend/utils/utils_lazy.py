@@ -0,0 +1,154 @@
+# Lazy import helpers for heavy SDKs
+
+import importlib
+import threading
+import time
+import types
+
+from logger.logging import Logger
+
+# Create logger object
+logger = Logger(__name__)
+
+# Guards loading of modules and running of initializers
+_lock = threading.RLock()
+
+# Lazy module proxies by module name
+_modules = {}
+
+# Initializers by module name, and names of the modules whose initializers already ran
+_initializers = {}
+_initialized = set()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module proxy which imports the real module on first attribute access.
+
+    Example:
+        generative_models = lazy_import("vertexai.generative_models")
+        ...
+        model = generative_models.GenerativeModel("gemini-1.5-pro")
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        """Import the module and run the initializers registered for it or its parent packages.
+
+        Returns:
+            The real module
+        """
+        module = self.__dict__["_module"]
+        if module is not None:
+            return module
+
+        with _lock:
+            module = self.__dict__["_module"]
+            if module is not None:
+                return module
+
+            start = time.perf_counter()
+            module = importlib.import_module(self.__name__)
+            _run_initializers(self.__name__)
+            logger.info(
+                "Imported %s in %.3fs", self.__name__, time.perf_counter() - start
+            )
+
+            # Copy the namespace so later attribute lookups skip __getattr__
+            self.__dict__.update(
+                {k: v for k, v in module.__dict__.items() if k != "__name__"}
+            )
+            self.__dict__["_module"] = module
+
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def _run_initializers(name: str) -> None:
+    """Run pending initializers of a module and its parent packages, outermost first.
+
+    Args:
+        name (str): Imported module name
+    """
+    parts = name.split(".")
+    for i in range(1, len(parts) + 1):
+        package = ".".join(parts[:i])
+        if package in _initializers and package not in _initialized:
+            _initialized.add(package)
+            for initializer in _initializers[package]:
+                initializer(importlib.import_module(package))
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Get a lazy proxy for a module. The module is imported on first attribute access.
+
+    Args:
+        name (str): Fully qualified module name
+
+    Returns:
+        LazyModule: Module proxy
+    """
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+
+def on_import(name: str, initializer) -> None:
+    """Register an initializer which runs once, right after the module (or any of its sub modules)
+    is first imported through a lazy proxy.
+
+    Example:
+        on_import("vertexai", lambda vertexai: vertexai.init(project=..., location=...))
+
+    Args:
+        name (str): Module name
+        initializer (callable): Called with the imported module
+    """
+    with _lock:
+        _initializers.setdefault(name, []).append(initializer)
+
+        # Module already imported, initialize immediately
+        loaded = any(
+            module.__dict__["_module"] is not None
+            and (module_name == name or module_name.startswith(name + "."))
+            for module_name, module in _modules.items()
+        )
+        if loaded and name not in _initialized:
+            _initialized.add(name)
+            initializer(importlib.import_module(name))
+
+
+def warm_up(names: list, background: bool = True):
+    """Import modules ahead of the first request which needs them.
+
+    Args:
+        names (list): Module names
+        background (bool): Import in a daemon thread so startup is not delayed. Defaults to True.
+
+    Returns:
+        threading.Thread: Warm up thread, or None when run in the foreground
+    """
+
+    def load():
+        for name in names:
+            try:
+                lazy_import(name)._load()
+            except Exception as e:
+                logger.error("Warm up of %s failed: %s.", name, e)
+
+    if not background:
+        load()
+        return None
+
+    thread = threading.Thread(target=load, name="WARMUP", daemon=True)
+    thread.start()
+    return thread
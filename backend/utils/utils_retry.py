@@ -0,0 +1,399 @@
+# Utility Module for retries, deadlines and hedging of model calls
+
+import asyncio
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+from config import Config
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+
+# Create logger object
+logger = Logger(__name__)
+
+CALL_RETRIES = REGISTRY.counter(
+    "call_retries", "Model calls retried after a retryable error", ("policy", "error")
+)
+CALL_HEDGES = REGISTRY.counter(
+    "call_hedges",
+    "Hedged requests sent, by whether the hedged request answered first",
+    ("policy", "result"),
+)
+CALL_DEADLINE_EXCEEDED = REGISTRY.counter(
+    "call_deadline_exceeded", "Model calls which exceeded their deadline", ("policy",)
+)
+
+# HTTP status codes of transient errors (google.api_core exceptions carry them as code)
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+CALL_ATTEMPTS_ABANDONED = REGISTRY.gauge(
+    "call_attempts_abandoned",
+    "Attempts still running after their caller stopped waiting (deadline or lost hedge)",
+    ("policy",),
+)
+
+# Attempts of sync calls with a deadline or hedging run in this pool
+_executor = ThreadPoolExecutor(
+    max_workers=Config.CALL_POLICY_THREADS, thread_name_prefix="call"
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call did not complete within the deadline of its CallPolicy"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is transient and the call can be retried.
+
+    Args:
+        error: Exception raised by the call
+
+    Returns:
+        True for rate limiting, unavailable or overloaded upstreams and timeouts
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+
+class CallPolicy:
+    """
+    Retries, deadline and hedging of model calls.
+
+    Retryable errors (see is_retryable) are retried with exponential backoff and full jitter, as long as
+    the deadline allows. With hedging, a second identical request is sent when the first one has not
+    answered after the p95 latency of the recent calls, and the first answer wins. Hedging doubles the
+    cost of slow calls and must only be used for idempotent calls, never e.g. for chat turns.
+
+    Blocking calls cannot be interrupted: an attempt which exceeds the deadline or loses a hedge keeps running
+    in the shared pool until the upstream answers. At most max_abandoned such attempts per policy are left
+    running; above that, hedging pauses and attempts run in the caller's thread, where the deadline is only
+    checked between attempts, so abandoned calls cannot fill the pool and delay every other call. Stateful
+    calls (call(..., stateful=True), e.g. chat turns) always run in the caller's thread, so a turn which
+    raised DeadlineExceeded was never committed to the chat history.
+
+    Example:
+        policy = get_call_policy("TextModel", "gemini-1.5-pro")
+        response = policy.call(model.generate_content, prompt)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        retries: int = 3,
+        initial_backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        deadline: float = None,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.1,
+        hedge_min_samples: int = 20,
+        max_abandoned: int = 8,
+        retryable: Callable[[BaseException], bool] = is_retryable,
+    ) -> None:
+        """Initializer
+
+        Args:
+            name: Policy name used in metrics and logs
+            retries: Number of retries after the first attempt
+            initial_backoff: Maximum seconds to wait before the first retry, doubled for every further retry
+            max_backoff: Maximum seconds to wait before a retry
+            deadline: Seconds for all attempts of a call. Default is None, i.e. no limit.
+            hedge: Send a hedged request when the first one is slow
+            hedge_quantile: Latency quantile of recent calls after which the hedged request is sent
+            hedge_min_delay: Minimum seconds before the hedged request is sent
+            hedge_min_samples: Number of recent calls needed before hedging starts
+            max_abandoned: Maximum number of blocking attempts left running in the pool after their caller
+                stopped waiting
+            retryable: Function deciding whether an error is retried
+        """
+        self.name = name
+        self.retries = retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.max_abandoned = max_abandoned
+        self.retryable = retryable
+
+        # Blocking attempts still running after their caller stopped waiting
+        self._abandoned = 0
+        self._abandoned_lock = threading.Lock()
+
+        # Latencies of recent successful attempts
+        self._latencies = collections.deque(maxlen=500)
+
+    def hedge_delay(self) -> float:
+        """Seconds after which a hedged request is sent.
+
+        Returns:
+            Delay, or None while there are not enough recent calls to estimate it
+        """
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.hedge_quantile), len(latencies) - 1)
+        return max(latencies[index], self.hedge_min_delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniformly random up to the exponential bound
+        return random.uniform(
+            0, min(self.max_backoff, self.initial_backoff * 2**attempt)
+        )
+
+    def _retry_delay(self, error: BaseException, attempt: int, start: float, deadline):
+        """Seconds to wait before retrying, or None when the error must be raised"""
+        if attempt >= self.retries or not self.retryable(error):
+            return None
+        delay = self._backoff(attempt)
+        if deadline is not None and time.monotonic() + delay - start >= deadline:
+            return None
+        CALL_RETRIES.inc(policy=self.name, error=type(error).__name__)
+        logger.warning(
+            "%s attempt %s failed, retrying in %.2fs: %s",
+            self.name,
+            attempt + 1,
+            delay,
+            error,
+        )
+        return delay
+
+    def _remaining(self, start: float, deadline) -> float:
+        if deadline is None:
+            return None
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            CALL_DEADLINE_EXCEEDED.inc(policy=self.name)
+            raise DeadlineExceeded(f"{self.name} call exceeded {deadline}s deadline")
+        return remaining
+
+    def call(
+        self,
+        func: Callable,
+        *args,
+        hedge: bool = None,
+        deadline: float = None,
+        stateful: bool = False,
+    ) -> Any:
+        """Call func(*args) with the policy.
+
+        Args:
+            func: Blocking function
+            args: Arguments of the function
+            hedge: Override of the policy's hedging, e.g. False for non idempotent calls
+            deadline: Override of the policy's deadline
+            stateful: The call changes state, e.g. a chat turn. It is never hedged nor abandoned: it runs in
+                the caller's thread and the deadline is only checked before each attempt.
+
+        Returns:
+            Result of the first successful attempt
+
+        Raises:
+            DeadlineExceeded: No attempt succeeded within the deadline
+            Exception: The error of the last attempt
+        """
+        hedge = (self.hedge if hedge is None else hedge) and not stateful
+        deadline = self.deadline if deadline is None else deadline
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                if (hedge or deadline is not None) and self._can_abandon(stateful):
+                    return self._call_in_pool(func, args, hedge, start, deadline)
+                self._remaining(start, deadline)
+                return self._timed(func, *args)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, start, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _timed(self, func: Callable, *args) -> Any:
+        attempt_start = time.monotonic()
+        result = func(*args)
+        self._latencies.append(time.monotonic() - attempt_start)
+        return result
+
+    def _can_abandon(self, stateful: bool) -> bool:
+        """Whether an attempt may run in the pool, where it is abandoned when the caller stops waiting"""
+        if stateful:
+            return False
+        if self._abandoned >= self.max_abandoned:
+            logger.warning(
+                "%s has %s abandoned attempts running, calling without deadline timer or hedging",
+                self.name,
+                self._abandoned,
+            )
+            return False
+        return True
+
+    def _abandon(self, futures) -> None:
+        """Stop waiting for attempts: queued ones are cancelled, running ones are counted until they end"""
+        for future in futures:
+            if future.done() or future.cancel():
+                continue
+            with self._abandoned_lock:
+                self._abandoned += 1
+            CALL_ATTEMPTS_ABANDONED.inc(policy=self.name)
+            future.add_done_callback(self._release)
+
+    def _release(self, future) -> None:
+        with self._abandoned_lock:
+            self._abandoned -= 1
+        CALL_ATTEMPTS_ABANDONED.dec(policy=self.name)
+
+    def _call_in_pool(self, func, args, hedge, start, deadline) -> Any:
+        """One attempt, hedged when it is slow, bounded by the deadline"""
+        futures = [_executor.submit(self._timed, func, *args)]
+        try:
+            delay = self.hedge_delay() if hedge else None
+            if delay is not None:
+                remaining = self._remaining(start, deadline)
+                done, _ = wait(
+                    futures, delay if remaining is None else min(delay, remaining)
+                )
+                if (
+                    not done
+                    and (remaining is None or remaining > delay)
+                    and self._abandoned < self.max_abandoned
+                ):
+                    futures.append(_executor.submit(self._timed, func, *args))
+
+            error = None
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending, self._remaining(start, deadline), FIRST_COMPLETED
+                )
+                if not done:
+                    self._remaining(start, deadline)
+                    continue
+                for future in done:
+                    if future.exception() is None:
+                        if len(futures) > 1:
+                            result = "won" if future is futures[1] else "lost"
+                            CALL_HEDGES.inc(policy=self.name, result=result)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # Reached on success, error and deadline: the other attempts' results are dropped
+            self._abandon(futures)
+
+    async def acall(
+        self, func: Callable, *args, hedge: bool = None, deadline: float = None
+    ) -> Any:
+        """Await func(*args) with the policy. Pending attempts are cancelled when the caller is cancelled.
+
+        Args:
+            func: Coroutine function
+            args: Arguments of the function
+            hedge: Override of the policy's hedging, e.g. False for non idempotent calls
+            deadline: Override of the policy's deadline
+
+        Returns:
+            Result of the first successful attempt
+
+        Raises:
+            DeadlineExceeded: No attempt succeeded within the deadline
+            Exception: The error of the last attempt
+        """
+        hedge = self.hedge if hedge is None else hedge
+        deadline = self.deadline if deadline is None else deadline
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                return await self._acall_once(func, args, hedge, start, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, start, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _atimed(self, func: Callable, *args) -> Any:
+        attempt_start = time.monotonic()
+        result = await func(*args)
+        self._latencies.append(time.monotonic() - attempt_start)
+        return result
+
+    async def _acall_once(self, func, args, hedge, start, deadline) -> Any:
+        """One attempt, hedged when it is slow, bounded by the deadline"""
+        tasks = [asyncio.ensure_future(self._atimed(func, *args))]
+        try:
+            delay = self.hedge_delay() if hedge else None
+            if delay is not None:
+                remaining = self._remaining(start, deadline)
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay if remaining is None else min(delay, remaining)
+                )
+                if not done and (remaining is None or remaining > delay):
+                    tasks.append(asyncio.ensure_future(self._atimed(func, *args)))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self._remaining(start, deadline),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self._remaining(start, deadline)
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            result = "won" if task is tasks[1] else "lost"
+                            CALL_HEDGES.inc(policy=self.name, result=result)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+# Policies by upstream and model, shared so hedging learns from all calls of a model
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_call_policy(upstream: str, model: str = "") -> CallPolicy:
+    """Shared call policy of an upstream and model, configured from Config.CALL_POLICIES.
+
+    Args:
+        upstream: Upstream name, e.g. "TextModel"
+        model: Model name
+
+    Returns:
+        Call policy
+    """
+    key = (upstream, model)
+    policy = _policies.get(key)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(key)
+            if policy is None:
+                settings = Config.CALL_POLICIES.get(
+                    upstream, Config.CALL_POLICIES.get("default", {})
+                )
+                name = f"{upstream}:{model}" if model else upstream
+                policy = _policies[key] = CallPolicy(name, **settings)
+    return policy
@@ -1,14 +1,23 @@
-from google.cloud import discoveryengine_v1beta as discoveryengine
-from google.cloud.discoveryengine_v1beta.services.search_service.pagers import (
-    SearchPager,
-)
-from google.cloud import aiplatform_v1
+from __future__ import annotations
 
+from typing import TYPE_CHECKING
+
+from backend.utils.utils_lazy import lazy_import
 from logger.logging import Logger
+from metrics.metrics import instrument
 
 # Create logger object
 logger = Logger(__name__)
 
+if TYPE_CHECKING:
+    from google.cloud.discoveryengine_v1beta.services.search_service.pagers import (
+        SearchPager,
+    )
+
+# Vertex AI Search and Vector Search SDK modules, imported on first use
+discoveryengine = lazy_import("google.cloud.discoveryengine_v1beta")
+aiplatform_v1 = lazy_import("google.cloud.aiplatform_v1")
+
 
 class VertexSearch:
     def __init__(
@@ -32,6 +41,7 @@ class VertexSearch:
         else:
             self.search_client = discoveryengine.SearchServiceClient()
 
+    @instrument("VertexSearch")
     def vertexai_search_oneturn(
         self,
         search_query: str,
@@ -96,6 +106,7 @@ class VertexSearch:
 
         return response
 
+    @instrument("VertexSearch")
     def vertexai_search_multiturn(
         self,
         search_query: str,
@@ -173,6 +184,7 @@ class VectorSearch:
             client_options={"api_endpoint": vector_api_endpoint}
         )
 
+    @instrument("VectorSearch")
     def find_neighbor(
         self,
         feature_vector: list,
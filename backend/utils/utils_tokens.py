@@ -0,0 +1,139 @@
+# Utility Module for token counting
+
+import collections
+import hashlib
+import math
+import threading
+from typing import Any, Callable
+
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+
+# Create logger object
+logger = Logger(__name__)
+
+TOKEN_COUNT_CACHE_REQUESTS = REGISTRY.counter(
+    "token_count_cache_requests",
+    "Exact token count lookups in the token count cache",
+    ("result",),
+)
+PROMPTS_TRIMMED = REGISTRY.counter(
+    "prompts_trimmed", "Prompts trimmed to their token budget", ("upstream",)
+)
+
+# Average number of characters per token of Gemini and PaLM models for English text
+CHARS_PER_TOKEN = 4
+
+
+class TokenBudgetExceeded(ValueError):
+    """An input is larger than the token budget of the call"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text without calling the model.
+
+    Args:
+        text: Text
+
+    Returns:
+        Estimated number of tokens
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def trim_to_budget(
+    text: str,
+    max_tokens: int,
+    count: Callable[[str], int] = estimate_tokens,
+    keep: str = "start",
+) -> str:
+    """Trim a text to a token budget, cutting at a whitespace.
+
+    Args:
+        text: Text
+        max_tokens: Token budget
+        count: Function counting the tokens of a text
+        keep: "start" keeps the beginning of the text, "end" keeps the end (e.g. for logs or conversations)
+
+    Returns:
+        The text when it fits, otherwise the longest part of it which fits
+    """
+    if count(text) <= max_tokens:
+        return text
+
+    # Binary search of the longest prefix (or suffix) which fits
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        part = text[:middle] if keep == "start" else text[len(text) - middle :]
+        if count(part) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+
+    if keep == "start":
+        part = text[:low]
+        cut = part.rfind(" ")
+        return part[:cut] if cut > 0 else part
+    part = text[len(text) - low :]
+    cut = part.find(" ")
+    return part[cut + 1 :] if cut >= 0 else part
+
+
+class TokenCounter:
+    """
+    Exact token counts from the model's count_tokens API, cached by content so documents reused across
+    prompts are counted once.
+
+    Example:
+        tokens = TOKEN_COUNTER.count(model, document_parts, key=document_name)
+    """
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        """Initializer
+
+        Args:
+            max_entries: Maximum number of cached counts
+        """
+        self.max_entries = max_entries
+        self._counts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, model, contents: Any, key: str = None) -> int:
+        """Exact number of tokens of contents.
+
+        Args:
+            model: GenerativeModel counting the tokens
+            contents: Text, Part or list of texts and Parts
+            key: Cache key of the contents, e.g. document names. Default is a hash of text contents; contents
+                with other parts are only cached with a key.
+
+        Returns:
+            Number of tokens
+        """
+        if key is None and isinstance(contents, str):
+            key = hashlib.sha256(contents.encode("utf-8")).hexdigest()
+        if key is not None:
+            key = (getattr(model, "_model_name", None), key)
+            with self._lock:
+                tokens = self._counts.get(key)
+                if tokens is not None:
+                    self._counts.move_to_end(key)
+            TOKEN_COUNT_CACHE_REQUESTS.inc(result="miss" if tokens is None else "hit")
+            if tokens is not None:
+                return tokens
+
+        tokens = model.count_tokens(contents).total_tokens
+
+        if key is not None:
+            with self._lock:
+                self._counts[key] = tokens
+                while len(self._counts) > self.max_entries:
+                    self._counts.popitem(last=False)
+        return tokens
+
+
+# Token counts shared by all models of the process
+TOKEN_COUNTER = TokenCounter()
@@ -1,4 +1,7 @@
-from google.cloud import translate_v3 as translate
+from backend.utils.utils_lazy import lazy_import
+
+# Cloud Translation SDK module, imported on first use
+translate = lazy_import("google.cloud.translate_v3")
 
 
 class GoogleCloudVertexTranslator:
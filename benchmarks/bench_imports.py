@@ -0,0 +1,100 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+
+Reports startup (import) time per module, each measured in a fresh interpreter. Compares the application
+modules, which import SDKs lazily, to the SDKs they wrap.
+
+Usage: python -m benchmarks.bench_imports [--repeat 3] [module ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Application modules
+APP_MODULES = [
+    "main",
+    "backend.models.language",
+    "backend.models.multimodel",
+    "backend.models.vision",
+    "backend.models.speech",
+    "backend.utils.utils_agent",
+    "backend.utils.utils_caching",
+    "backend.utils.utils_conversation",
+    "backend.utils.utils_embedding",
+    "backend.utils.utils_search",
+    "backend.utils.utils_translate",
+    "backend.utils.connectors.utils_bq",
+    "backend.utils.connectors.utils_gcs",
+    "backend.utils.connectors.utils_secret",
+]
+
+# SDK modules which used to be imported at application startup
+SDK_MODULES = [
+    "vertexai",
+    "vertexai.generative_models",
+    "vertexai.language_models",
+    "vertexai.vision_models",
+    "google.cloud.discoveryengine_v1beta",
+    "google.cloud.aiplatform_v1",
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "google.cloud.dialogflowcx_v3",
+    "google.cloud.texttospeech",
+    "google.cloud.speech",
+    "google.cloud.translate_v3",
+    "google.cloud.secretmanager",
+]
+
+SNIPPET = (
+    "import time; start = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def measure(module: str, repeat: int) -> float:
+    """
+    Median import time of a module in fresh interpreters
+
+    :param module: Module name
+    :param repeat: Number of interpreters to start
+
+    :return: Median seconds, or None when the module cannot be imported
+    """
+
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(module=module)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("modules", nargs="*")
+    args = parser.parse_args()
+
+    modules = args.modules or APP_MODULES + SDK_MODULES
+
+    print(f"{'module':<42}{'import ms':>12}")
+    for module in modules:
+        seconds = measure(module, args.repeat)
+        timing = "not installed" if seconds is None else f"{seconds * 1000:.1f}"
+        print(f"{module:<42}{timing:>12}")
+
+
+if __name__ == "__main__":
+    main()
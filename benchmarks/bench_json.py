@@ -0,0 +1,94 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+
+Compares the JSON serializers used by JSONEndPoint on the payload shapes sent by the UIs.
+
+Usage: python -m benchmarks.bench_json [--image-kb 2048] [--repeat 20]
+"""
+
+import argparse
+import base64
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from router.serialization import SERIALIZERS, orjson  # noqa: E402
+
+
+def payloads(image_kb: int) -> dict:
+    """
+    Request and response shapes of the sample UIs
+
+    :param image_kb: Size of each raw image in KB before base64 encoding
+
+    :return: Dictionary of payload name to payload
+    """
+
+    image = base64.b64encode(os.urandom(image_kb * 1024)).decode("ascii")
+
+    return {
+        # ChatbotUI request/response
+        "chat_request": {"user_input": "What is the refund policy for damaged items?"},
+        "chat_response": {"bot_response": "Lorem ipsum dolor sit amet. " * 40},
+        # SearchUI response
+        "search_response": {
+            "summary": "Summary of the search generated through GenAI. " * 10,
+            "results": [
+                {
+                    "title": f"Document {i}",
+                    "link": f"http://localhost/document{i}.html",
+                    "text": "This document talks about type 1 details. " * 5,
+                }
+                for i in range(20)
+            ],
+        },
+        # ImageEditorUI request
+        "image_editor_request": {
+            "prompt": "Replace the sky with a sunset",
+            "image": image,
+            "mask_start_x": 10,
+            "mask_start_y": 10,
+            "mask_end_x": 200,
+            "mask_end_y": 120,
+            "image_width": 1024,
+            "image_height": 1024,
+            "neg_prompt_input": "clouds",
+        },
+        # ImageSearchUI / ImageEditorUI response with generated images
+        "images_response": {"images": [image] * 4},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--image-kb", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson is not installed, only the stdlib serializer is measured.\n")
+
+    serializers = {}
+    for name, serializer_class in SERIALIZERS.items():
+        try:
+            serializers[name] = serializer_class()
+        except ImportError:
+            continue
+
+    print(f"{'payload':<22}{'serializer':<10}{'dumps ms':>10}{'loads ms':>10}")
+    for payload_name, payload in payloads(args.image_kb).items():
+        for name, serializer in serializers.items():
+            encoded = serializer.dumps(payload)
+            dumps = timeit.timeit(lambda: serializer.dumps(payload), number=args.repeat)
+            loads = timeit.timeit(lambda: serializer.loads(encoded), number=args.repeat)
+            print(
+                f"{payload_name:<22}{name:<10}"
+                f"{dumps / args.repeat * 1000:>10.3f}{loads / args.repeat * 1000:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+
+Measures the per request cost of the debug logging done by JSONEndPoint and the models when DEBUG is disabled,
+comparing eager f-string messages (before) to deferred %-style arguments with level guards (after).
+
+Usage: python -m benchmarks.bench_logging [--image-kb 2048] [--repeat 200]
+"""
+
+import argparse
+import base64
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from logger.logging import DEBUG, INFO, Logger  # noqa: E402
+
+
+class FakeURL:
+    """Stands in for starlette's URL, which is built when request.url is accessed"""
+
+    def __init__(self, scope: dict) -> None:
+        self.url = f"{scope['scheme']}://{scope['server']}{scope['path']}"
+
+    def __str__(self) -> str:
+        return self.url
+
+
+class FakeRequest:
+    scope = {"scheme": "http", "server": "localhost:5000", "path": "/process"}
+    method = "POST"
+
+    @property
+    def url(self):
+        return FakeURL(self.scope)
+
+
+def before(logger, request, request_id, request_body, prompt, response):
+    logger.debug(
+        f"HTTP Request - ID: {request_id} URL: {request.url} Method: {request.method} JSON: {request_body}"
+    )
+    logger.debug(f"Generating Text for prompt: {prompt}")
+    logger.debug(f"Prediction Response: {response}")
+    logger.debug(f"HTTP Response - ID: {request_id} JSON: {response}")
+
+
+def after(logger, request, request_id, request_body, prompt, response):
+    if logger.isEnabledFor(DEBUG):
+        logger.debug(
+            "HTTP Request - ID: %s URL: %s Method: %s JSON: %s",
+            request_id,
+            request.url,
+            request.method,
+            request_body,
+        )
+    logger.debug("Generating Text for prompt: %s", prompt)
+    logger.debug("Prediction Response: %s", response)
+    logger.debug("HTTP Response - ID: %s JSON: %s", request_id, response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--image-kb", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    image = base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    request_body = {"prompt": "Describe this image", "image": image}
+    prompt = "Describe this image " * 200
+    response = {"text": "A cat sitting on a sofa. " * 200}
+
+    # DEBUG disabled, as in production
+    logger = Logger("benchmarks.bench_logging", level=INFO)
+    call_args = (logger, FakeRequest(), 1234567, request_body, prompt, response)
+
+    print(f"{'variant':<10}{'us/request':>14}")
+    for name, func in (("before", before), ("after", after)):
+        seconds = timeit.timeit(lambda: func(*call_args), number=args.repeat)
+        print(f"{name:<10}{seconds / args.repeat * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+__all__ = ["CacheBackend", "MemoryCache", "SQLiteCache", "create_cache"]
+
+
+class CacheBackend(ABC):
+    """
+    Key value cache of bytes with per entry TTL and size bounded LRU eviction
+    """
+
+    # True when calls block on I/O and should run in the threadpool when used from the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """
+        :param key: Cache key
+
+        :return: Cached value, or None when missing or expired
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        """
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Seconds until the entry expires. None never expires.
+
+        :return: None
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        :param key: Cache key
+
+        :return: None
+        """
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Remove all entries
+
+        :return: None
+        """
+
+
+class MemoryCache(CacheBackend):
+    """
+    In process LRU cache, bounded by number of entries and total size of the values
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param max_entries: Maximum number of entries
+        :param max_bytes: Maximum total size of the values in bytes
+
+        :return: None
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    LRU cache in a local SQLite database. The database file can be shared by the worker processes of a node
+    and survives restarts.
+    """
+
+    blocking = True
+
+    # Evict once every this many writes rather than on every write
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, max_entries: int = 10000, timeout: float = 5.0):
+        """
+        :param path: Path of the database file
+        :param max_entries: Maximum number of entries
+        :param timeout: Seconds to wait for a lock held by another process
+
+        :return: None
+        """
+
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread. Connections are not shared between threads or across a fork.
+        """
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> bytes:
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            row = connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            connection.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), expires_at, now),
+            )
+
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(connection, now)
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        """
+        Remove expired entries and the least recently used ones above max_entries
+        """
+
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM cache")
+
+
+def create_cache(backend: str = "memory", **kwargs) -> CacheBackend:
+    """
+    Create a cache backend by name.
+
+    :param backend: "memory" or "sqlite"
+    :param kwargs: Arguments of the backend class
+
+    :return: Cache backend
+    """
+
+    backends = {"memory": MemoryCache, "sqlite": SQLiteCache}
+    if backend not in backends:
+        raise ValueError(f"{backend} cache backend not supported.")
+
+    return backends[backend](**kwargs)
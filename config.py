@@ -1,5 +1,8 @@
 # config.py
 
+import json
+import os
+
 
 class Config:
     """
@@ -10,7 +13,58 @@ class Config:
     PROJECT_ID = "ezyai-demos"
     LOCATION = "us-central1"
 
+    # Server configurations
+    # Number of worker processes. 1 serves from a thread; more forks workers sharing the port.
+    SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 1))
+    # Seconds browsers may reuse the UI page before revalidating it with its ETag
+    UI_CACHE_MAX_AGE = 0
+    # Seconds browsers may cache static files which are not fingerprinted, e.g. images
+    STATIC_CACHE_MAX_AGE = 3600
+    # SDK modules imported in the background after startup instead of on the first request that needs
+    # them, e.g. ["vertexai.generative_models"]. Empty list imports every SDK on first use.
+    LAZY_WARMUP_MODULES = []
+    # Per route concurrency limits of each worker. Requests over max_concurrency wait up to queue_timeout
+    # seconds in a queue of max_queue requests, otherwise they are rejected with 429/503 and Retry-After.
+    ADMISSION_LIMITS = {
+        "/process": {
+            "max_concurrency": 64,
+            "max_queue": 128,
+            "queue_timeout": 10,
+            "retry_after": 1,
+        },
+    }
+    # Response cache of JSON endpoints. None disables it. Memory backend: {"backend": "memory",
+    # "max_entries": 1024}. SQLite backend shared by the workers of a node: {"backend": "sqlite",
+    # "path": "/tmp/ezyai/response_cache.sqlite", "max_entries": 10000}.
+    RESPONSE_CACHE = None
+    # Seconds responses stay cached, per route
+    RESPONSE_CACHE_TTL = {"/process": 300}
+
     # Generative AI model and parameters
+    # Retries, deadline (seconds for all attempts of a call, None for no limit) and hedging of model calls by
+    # upstream (TextModel, MyChatModel, MultiModel, BaseAgent, GeminiContentCache), "default" for the others.
+    # Hedging sends a second request when the first one is slower than the p95 latency of the model, and is
+    # never used for chat turns. Chat turns run in the caller's thread, their deadline is checked before each
+    # attempt and a turn is never committed after DeadlineExceeded.
+    CALL_POLICIES = {
+        "default": {
+            "retries": 3,
+            "initial_backoff": 0.5,
+            "max_backoff": 8,
+            "deadline": None,
+            "hedge": False,
+        },
+    }
+    # Threads of the pool running blocking model calls with a deadline or hedging, shared by all policies of a
+    # worker. Each policy leaves at most max_abandoned timed out or losing attempts running in it.
+    CALL_POLICY_THREADS = 64
+
+    # Serve all models from local fakes instead of Vertex AI, for load tests without network or cost. None
+    # calls Vertex AI. Otherwise settings of backend.models.fake.FakeSettings, e.g. {"latency_median": 0.5,
+    # "latency_sigma": 0.5, "error_rate": 0.01}. Set from the FAKE_MODELS environment variable as JSON.
+    FAKE_MODELS = (
+        json.loads(os.environ["FAKE_MODELS"]) if os.environ.get("FAKE_MODELS") else None
+    )
 
     # Prompts
     DEFAULT_SYSTEM_INSTRUCTION = """
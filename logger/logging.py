@@ -3,46 +3,457 @@ Copyright 2023 Google. This software is provided as-is, without warranty or repr
 Your use of it is subject to your agreement with Google.
 """
 
+import atexit
+import contextvars
+import copy
+import datetime
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+# Log levels, re-exported for level guards: if logger.isEnabledFor(DEBUG): ...
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+CRITICAL = logging.CRITICAL
+
+# Level of Logger objects created without an explicit level
+DEFAULT_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+
+# Maximum number of log records waiting to be written. Records over the limit are dropped.
+QUEUE_SIZE = 10000
+
+# Which records to drop when the queue is full: "newest" drops the record being logged, "oldest" drops the
+# oldest queued record to make room for it.
+DROP_POLICY = "newest"
+
+# Structured JSON output instead of plain text. Set with configure() or LOG_FORMAT=json.
+STRUCTURED = os.environ.get("LOG_FORMAT", "text").lower() == "json"
+
+# Maximum length of string fields (message, prompts, base64 images...) in structured output
+MAX_FIELD_LENGTH = int(os.environ.get("LOG_MAX_FIELD_LENGTH", 2048))
+
+# Fraction of records below WARNING that are kept, by logger name prefix and by event name. Records of a
+# request are sampled together, so a kept request keeps all its debug records.
+SAMPLE_RATES = {}
+EVENT_SAMPLE_RATES = {}
+
+# Request ID of the current request, added to every record
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has, everything else on a record is an extra field
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {
+    "message",
+    "asctime",
+    "request_id",
+    "event",
+}
+
+
+def configure(
+    structured: bool = None,
+    max_field_length: int = None,
+    sample_rates: dict = None,
+    event_sample_rates: dict = None,
+) -> None:
+    """
+    Configure the output of all Logger objects.
+
+    :param structured: Write one JSON object per record
+    :param max_field_length: Maximum length of string fields in structured output
+    :param sample_rates: Fraction of records below WARNING to keep by logger name prefix, e.g. {"backend": 0.1}
+    :param event_sample_rates: Fraction of records below WARNING to keep by event, e.g. {"prompt": 0.01}
+
+    :return: None
+    """
+
+    global STRUCTURED, MAX_FIELD_LENGTH
+
+    if structured is not None:
+        STRUCTURED = structured
+    if max_field_length is not None:
+        MAX_FIELD_LENGTH = max_field_length
+    if sample_rates is not None:
+        SAMPLE_RATES.update(sample_rates)
+    if event_sample_rates is not None:
+        EVENT_SAMPLE_RATES.update(event_sample_rates)
+
+
+def set_request_id(request_id: str = None) -> str:
+    """
+    Set the request ID added to the records logged by the current request (context).
+
+    :param request_id: Request ID, e.g. from the X-Request-ID header. A new one is generated when None.
+
+    :return: Request ID
+    """
+
+    request_id = request_id or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def get_request_id() -> str:
+    """
+    :return: Request ID of the current request, or None outside of a request
+    """
+    return _request_id.get()
+
+
+def _truncate(value, limit: int):
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}...[truncated {len(value) - limit} chars]"
+    return value
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object with severity, logger, message, request_id, event and extra fields.
+    String fields longer than MAX_FIELD_LENGTH are truncated.
+    """
+
+    def format(self, record) -> str:
+        limit = MAX_FIELD_LENGTH
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage(), limit),
+        }
+
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                if not isinstance(value, (str, int, float, bool, type(None))):
+                    value = str(value)
+                entry[key] = _truncate(value, limit)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DefaultFormatter(logging.Formatter):
+    """
+    Plain text formatter, or JSONFormatter when STRUCTURED is set
+    """
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.json_formatter = JSONFormatter()
+
+    def format(self, record) -> str:
+        if STRUCTURED:
+            return self.json_formatter.format(record)
+        return super().format(record)
+
+
+# Formatter used to render tracebacks before records are queued
+_exception_formatter = logging.Formatter()
+
+# Default formatter
+DEFAULT_FORMATTER = _DefaultFormatter()
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Runs in the thread which logs the record, before it is queued: adds the request ID (read from the calling
+    context) to the record and samples records below WARNING.
+    """
+
+    def filter(self, record) -> bool:
+        request_id = _request_id.get()
+        record.request_id = request_id
+
+        if record.levelno >= logging.WARNING or not (
+            SAMPLE_RATES or EVENT_SAMPLE_RATES
+        ):
+            return True
+
+        rate = EVENT_SAMPLE_RATES.get(getattr(record, "event", None), 1.0)
+        name = record.name
+        while name:
+            if name in SAMPLE_RATES:
+                rate = min(rate, SAMPLE_RATES[name])
+                break
+            name = name.rpartition(".")[0]
+
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+
+        # Same decision for every record of a request
+        if request_id:
+            return zlib.crc32(request_id.encode("utf-8")) / 2**32 < rate
+        return random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which never blocks. When the bounded queue is full records are dropped according to
+    DROP_POLICY and counted.
+    """
+
+    def prepare(self, record):
+        # Merge the arguments into the message, but keep the traceback in exc_text instead of appending it to the
+        # message, so formatters on the writer thread can still render it on its own
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if DROP_POLICY == "oldest":
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            _writer.record_dropped()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener which waits for room in a full queue when stopping instead of failing.
+    """
+
+    def enqueue_sentinel(self):
+        try:
+            self.queue.put(self._sentinel, timeout=1)
+        except queue.Full:
+            pass
+
+
+class _Dispatcher(logging.Handler):
+    """
+    Handler run by the background writer. Sends each record to the handlers registered for its logger.
+    """
+
+    def __init__(self, writer) -> None:
+        super().__init__()
+        self.writer = writer
+
+    def handle(self, record):
+        for handler in self.writer.handlers.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+        self.writer.report_dropped()
+
+
+class _Writer:
+    """
+    Single background thread writing the records of all Logger objects of the process.
+    """
+
+    def __init__(self) -> None:
+        self.handlers = {}
+        self.queue_handlers = []
+        self.console_handlers = {}
+        self.file_handlers = {}
+        self.dropped = 0
+        self.reported = 0
+        self.reported_at = 0.0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.listener = None
+        self.start()
+
+    def start(self) -> None:
+        self.listener = _QueueListener(self.queue, _Dispatcher(self))
+        self.listener.start()
+
+    def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+        for handler in list(self.file_handlers.values()):
+            handler.close()
+
+    def after_fork(self) -> None:
+        """
+        The writer thread does not survive a fork. The child gets a new queue and writer thread; the queue
+        of the parent may be locked by a thread that does not exist in the child.
+        """
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(QUEUE_SIZE)
+        for handler in self.queue_handlers:
+            handler.queue = self.queue
+        self.dropped = self.reported = 0
+        self.start()
+
+    def record_dropped(self) -> None:
+        with self.lock:
+            self.dropped += 1
+
+    def report_dropped(self) -> None:
+        """
+        Write a warning with the number of records dropped since the last report, at most once a second.
+        Runs on the writer thread.
+        """
+
+        dropped = self.dropped - self.reported
+        if dropped <= 0 or time.monotonic() - self.reported_at < 1:
+            return
+
+        self.reported += dropped
+        self.reported_at = time.monotonic()
+        record = logging.LogRecord(
+            __name__,
+            logging.WARNING,
+            __file__,
+            0,
+            f"Log queue full, {dropped} log records dropped",
+            None,
+            None,
+        )
+        self.console_handler(DEFAULT_FORMATTER).handle(record)
+
+    def console_handler(self, formatter) -> logging.Handler:
+        """
+        Console handler for a formatter, shared by all loggers using it
+        """
+
+        handler = self.console_handlers.get(id(formatter))
+        if handler is None:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(formatter)
+            self.console_handlers[id(formatter)] = handler
+        return handler
+
+    def file_handler(self, file_name: str, formatter) -> logging.Handler:
+        """
+        File handler for a file and formatter, shared by all loggers using them
+        """
+
+        key = (os.path.abspath(file_name), id(formatter))
+        handler = self.file_handlers.get(key)
+        if handler is None:
+            handler = logging.FileHandler(file_name)
+            handler.setFormatter(formatter)
+            self.file_handlers[key] = handler
+        return handler
+
+    def register(self, logger: logging.Logger, handlers: list) -> None:
+        """
+        Route the records of a logger to handlers through the queue. Registering a logger again replaces its
+        handlers instead of adding duplicates.
+        """
+
+        self.handlers[logger.name] = tuple(handlers)
+
+        if not any(isinstance(h, _QueueHandler) for h in logger.handlers):
+            queue_handler = _QueueHandler(self.queue)
+            queue_handler.addFilter(_ContextFilter())
+            self.queue_handlers.append(queue_handler)
+            logger.addHandler(queue_handler)
+
+
+_writer = _Writer()
+atexit.register(_writer.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_writer.after_fork)
 
 
 class Logger:
     """
     Utility to help capture logs and errors across the application in a standarized manner.
+
+    Records are put on a bounded queue and written by a single background thread shared by all Logger
+    objects, so logging never blocks the caller on I/O. When the queue is full records are dropped and the
+    number of dropped records is reported.
+
+    Messages support deferred %-style arguments, which are only formatted when the level is enabled:
+
+        logger.debug("Prediction Response: %s", response)
+
+    Guard computations needed only for logging with isEnabledFor(). The default level is taken from the
+    LOG_LEVEL environment variable (DEBUG when unset).
+
+    With structured logging (configure(structured=True) or LOG_FORMAT=json) every record is written as JSON
+    with the request ID set by set_request_id(). Records can be tagged with an event and extra fields, which
+    are truncated to MAX_FIELD_LENGTH and can be sampled per logger and per event:
+
+        logger.debug("Generating Text", event="prompt", extra={"prompt": prompt})
     """
 
-    def __init__(self, name, level=logging.DEBUG, file_name=None, formatter=None):
+    def __init__(
+        self, name, level=None, file_name=None, formatter=None, sample_rate=None
+    ):
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(level)
+        self.logger.setLevel(level if level is not None else DEFAULT_LEVEL)
+
+        # Fraction of records below WARNING to keep (optional)
+        if sample_rate is not None:
+            SAMPLE_RATES[name] = sample_rate
 
         # Default formatter
         if formatter is None:
-            formatter = logging.Formatter(
-                "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-            )
+            formatter = DEFAULT_FORMATTER
 
         # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
+        handlers = [_writer.console_handler(formatter)]
 
         # File handler (optional)
         if file_name:
-            file_handler = logging.FileHandler(file_name)
-            file_handler.setFormatter(formatter)
-            self.logger.addHandler(file_handler)
+            handlers.append(_writer.file_handler(file_name, formatter))
+
+        _writer.register(self.logger, handlers)
+
+    def isEnabledFor(self, level) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, msg, args, event, kwargs):
+        if event is not None:
+            kwargs["extra"] = {**kwargs.get("extra", {}), "event": event}
+
+        # Report the caller of debug()/info()/... as the origin of the record
+        kwargs.setdefault("stacklevel", 3)
+        self.logger.log(level, msg, *args, **kwargs)
 
-    def debug(self, msg):
-        self.logger.debug(msg)
+    def debug(self, msg, *args, event=None, **kwargs):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, msg, args, event, kwargs)
 
-    def info(self, msg):
-        self.logger.info(msg)
+    def info(self, msg, *args, event=None, **kwargs):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, msg, args, event, kwargs)
 
-    def warning(self, msg):
-        self.logger.warning(msg)
+    def warning(self, msg, *args, event=None, **kwargs):
+        self._log(logging.WARNING, msg, args, event, kwargs)
 
-    def error(self, msg):
-        self.logger.error(msg)
+    def error(self, msg, *args, event=None, **kwargs):
+        self._log(logging.ERROR, msg, args, event, kwargs)
 
-    def critical(self, msg):
-        self.logger.critical(msg)
+    def critical(self, msg, *args, event=None, **kwargs):
+        self._log(logging.CRITICAL, msg, args, event, kwargs)
@@ -7,19 +7,27 @@ from __future__ import annotations
 
 
 import asyncio
+import multiprocessing
+import signal
+import socket
 import threading
 import os
 import time
+from typing import Callable, Optional
 from fastapi import FastAPI
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
-from starlette.staticfiles import StaticFiles
 from starlette.routing import Route
 from starlette.schemas import SchemaGenerator
-import vertexai
 
+from backend.utils.utils_lazy import on_import, warm_up
+from cache.backends import create_cache
 from logger.logging import Logger
+from metrics.metrics import REGISTRY
+from router.admission import AdmissionControlMiddleware
+from router.assets import PrecompressedStaticFiles
 from router.json import JSONEndPoint
+from router.metrics import MetricsEndPoint, MetricsMiddleware
 from router.ui import UIEndPoint
 import config
 
@@ -27,8 +35,17 @@ import config
 # initializing configurations
 conf = config.Config()
 
-# vertex ai sdk intitialization
-vertexai.init(project=conf.PROJECT_ID, location=conf.LOCATION)
+# vertex ai sdk intitialization, deferred until the SDK is first imported
+on_import(
+    "vertexai",
+    lambda vertexai: vertexai.init(project=conf.PROJECT_ID, location=conf.LOCATION),
+)
+
+# local fake models for load tests, set before workers fork so they inherit it
+if conf.FAKE_MODELS is not None:
+    from backend.models.fake import enable_fake_models
+
+    enable_fake_models(**conf.FAKE_MODELS)
 
 #####################################################
 # EXAMPLE: Import router endpoints. Add/Update/Delete as necessary.
@@ -45,12 +62,25 @@ class Server:
     FastAPI based server to expose endpoints for the application
     """
 
-    def __init__(self, address: str = "0.0.0.0", port: int = 5000) -> None:
+    def __init__(
+        self,
+        address: str = "0.0.0.0",
+        port: int = 5000,
+        workers: int = 1,
+        on_worker_start: Optional[Callable[[FastAPI, int], None]] = None,
+        heartbeat_interval: float = 5.0,
+        heartbeat_timeout: float = 60.0,
+    ) -> None:
         """
         Initializes Server object
 
         :param address: Address to bind Server on. Deafult is 0.0.0.0
         :param port: Port to bind Server on. Default is 5000.
+        :param workers: Number of worker processes. Default is 1, which serves from a thread in this process.
+        :param on_worker_start: Hook called once inside every worker as on_worker_start(app, worker_id) before
+            it starts serving. Use it to create model clients once per worker, e.g. on app.state.
+        :param heartbeat_interval: Seconds between worker heartbeats and supervisor health checks.
+        :param heartbeat_timeout: Seconds without a heartbeat after which a worker is restarted.
 
         :return: None
         """
@@ -58,6 +88,10 @@ class Server:
         # Initialize object variables
         self.address = address
         self.port = port
+        self.workers = max(1, workers)
+        self.on_worker_start = on_worker_start
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
 
         # Initialise API documentation download
         self.apis = SchemaGenerator(
@@ -68,6 +102,12 @@ class Server:
         self._thread = None
         self._stop_thread_event = None
 
+        # Initialize process context to serve requests using worker processes
+        self._processes = {}
+        self._restarts = [0] * self.workers
+        self._heartbeats = None
+        self._listen_socket = None
+
         # Create FastApi app
         self._app = self._create_app()
 
@@ -84,14 +124,29 @@ class Server:
         # List to save different routes
         routes = []
 
+        # Static files directory. UI JS/CSS assets are built into it at startup.
+        static_dir = os.path.join(os.path.dirname(__file__), "frontend/static")
+
         # Route to download API endpoints availble in OpenAPI format
         routes.append(Route("/apis", endpoint=self.dump_apis, include_in_schema=False))
 
+        # Route to scrape metrics in Prometheus format
+        routes.append(
+            Route("/metrics", MetricsEndPoint().get_request, include_in_schema=False)
+        )
+
         #####################################################
         # EXAMPLE: UI and JSON routers. Add/Update/Delete as necessary.
-        routes.append(Route("/", UIEndPoint().get_request))
+        # UI page is rendered once at startup and then served from memory with an ETag
+        ui_endpoint = UIEndPoint(max_age=conf.UI_CACHE_MAX_AGE, static_dir=static_dir)
+        ui_endpoint.render()
+        routes.append(Route("/", ui_endpoint.get_request))
+        json_endpoint = JSONEndPoint(
+            cache=create_cache(**conf.RESPONSE_CACHE) if conf.RESPONSE_CACHE else None,
+            cache_ttl=conf.RESPONSE_CACHE_TTL.get("/process", 300),
+        )
         routes.append(
-            Route("/process", JSONEndPoint().get_request, methods=["GET", "POST"])
+            Route("/process", json_endpoint.get_request, methods=["GET", "POST"])
         )
         #####################################################
 
@@ -101,17 +156,28 @@ class Server:
         #####################################################
         # EXAMPLE: Webpage mount static files if Web interface also required. Required for Webpage.
         # Add/Update/Delete as necessary.
-        static_dir = os.path.join(os.path.dirname(__file__), "frontend/static")
-        app.mount("/static", StaticFiles(directory=static_dir), name="static")
+        app.mount(
+            "/static",
+            PrecompressedStaticFiles(
+                directory=static_dir, max_age=conf.STATIC_CACHE_MAX_AGE
+            ),
+            name="static",
+        )
         #####################################################
 
+        # Bound concurrent requests per route, shedding load with 429/503 when saturated
+        app.add_middleware(AdmissionControlMiddleware, limits=conf.ADMISSION_LIMITS)
+
+        # Record per route request metrics. Added last so it also records rejected requests.
+        app.add_middleware(MetricsMiddleware, routes=app.routes)
+
         return app
 
-    async def _start(self) -> None:
+    def _config(self) -> Config:
         """
-        Background internal function to start Server. This function runs as a coroutine.
+        Create the Hypercorn configuration shared by all serving modes
 
-        :return: None
+        :return: Hypercorn Config
         """
 
         # Config for Hypercorn server.
@@ -133,6 +199,17 @@ class Server:
         )
         config.bind = [f"{self.address}:{self.port}"]
 
+        return config
+
+    async def _start(self) -> None:
+        """
+        Background internal function to start Server. This function runs as a coroutine.
+
+        :return: None
+        """
+
+        config = self._config()
+
         # Event to gracefully stop the server. When thread stops, it is set
         shutdown_event = asyncio.Event()
 
@@ -141,7 +218,7 @@ class Server:
             serve(self._app, config, shutdown_trigger=shutdown_event.wait)
         )
 
-        logger.info(f"Server listening on http://{self.address}:{self.port}")
+        logger.info("Server listening on http://%s:%s", self.address, self.port)
 
         # Run forever until the self._stop_thread_event is set. If stop thread event is set, then set
         # the shutdown_event which stops the server_task. This results in graceful shutdown.
@@ -153,6 +230,153 @@ class Server:
             shutdown_event.set()
             await server_task
 
+    def _create_socket(self) -> socket.socket:
+        """
+        Create a listening socket for the server address. SO_REUSEPORT is set when the platform
+        supports it so that every worker can bind its own socket and the kernel balances connections.
+
+        :return: Listening socket
+        """
+
+        family = socket.AF_INET6 if ":" in self.address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.address.strip("[]"), self.port))
+        sock.listen(self._config().backlog)
+        sock.set_inheritable(True)
+
+        return sock
+
+    async def _serve_worker(self, worker_id: int, sock: socket.socket) -> None:
+        """
+        Serve requests inside a worker process until it receives SIGTERM or SIGINT. This function runs
+        as a coroutine.
+
+        :param worker_id: Index of the worker
+        :param sock: Listening socket for the worker
+
+        :return: None
+        """
+
+        config = self._config()
+        config.bind = [f"fd://{sock.fileno()}"]
+
+        # Event to gracefully stop the worker when the supervisor terminates it
+        shutdown_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, shutdown_event.set)
+
+        # Heartbeat runs on the event loop, so a blocked loop shows up as a stale heartbeat
+        async def heartbeat():
+            while True:
+                self._heartbeats[worker_id] = time.time()
+                await asyncio.sleep(self.heartbeat_interval)
+
+        heartbeat_task = asyncio.create_task(heartbeat())
+
+        logger.info(
+            "Worker %s (pid %s) listening on http://%s:%s",
+            worker_id,
+            os.getpid(),
+            self.address,
+            self.port,
+        )
+
+        try:
+            await serve(self._app, config, shutdown_trigger=shutdown_event.wait)
+        finally:
+            heartbeat_task.cancel()
+
+    def _run_worker(self, worker_id: int) -> None:
+        """
+        Entry point of a worker process.
+
+        :param worker_id: Index of the worker
+
+        :return: None
+        """
+
+        # Metrics of each worker are told apart by a worker label, /metrics only reports the scraped worker
+        REGISTRY.const_labels = {"worker": str(worker_id)}
+
+        # Per worker initialisation, e.g. model clients which must not be shared across a fork
+        if self.on_worker_start is not None:
+            self.on_worker_start(self._app, worker_id)
+
+        # Import SDKs in the background so the first request does not pay for it
+        warm_up(conf.LAZY_WARMUP_MODULES)
+
+        sock = self._listen_socket or self._create_socket()
+        asyncio.run(self._serve_worker(worker_id, sock))
+
+    def _spawn_worker(self, worker_id: int) -> None:
+        """
+        Start (or restart) a worker process.
+
+        :param worker_id: Index of the worker
+
+        :return: None
+        """
+
+        # Give the new worker a full heartbeat_timeout to start up
+        self._heartbeats[worker_id] = time.time()
+
+        process = multiprocessing.get_context("fork").Process(
+            target=self._run_worker, args=(worker_id,), name=f"WORKER-{worker_id}"
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    def _supervise(self) -> None:
+        """
+        Background internal function which restarts workers that exit or stop sending heartbeats,
+        and terminates all of them once the server is stopped.
+
+        :return: None
+        """
+
+        while not self._stop_thread_event.wait(self.heartbeat_interval):
+            now = time.time()
+            for worker_id, process in list(self._processes.items()):
+                stale = now - self._heartbeats[worker_id] > self.heartbeat_timeout
+                if process.is_alive() and not stale:
+                    continue
+
+                if process.is_alive():
+                    logger.warning(
+                        "Worker %s (pid %s) missed heartbeats, restarting",
+                        worker_id,
+                        process.pid,
+                    )
+                    process.kill()
+                    process.join()
+                else:
+                    logger.warning(
+                        "Worker %s (pid %s) exited with code %s, restarting",
+                        worker_id,
+                        process.pid,
+                        process.exitcode,
+                    )
+
+                self._restarts[worker_id] += 1
+                self._spawn_worker(worker_id)
+
+        # Graceful shutdown of the workers, forced if they do not exit in time
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+        if self._listen_socket is not None:
+            self._listen_socket.close()
+            self._listen_socket = None
+
     def start(self) -> None:
         """
         Start the server ascynchronously.
@@ -160,12 +384,41 @@ class Server:
         :return: None
         """
 
-        # Create a thread and run webserver inside it inside an event loop. _stop_threading_event
-        # is used to gracefully shutdown the thread.
         self._stop_thread_event = threading.Event()
-        self._thread = threading.Thread(
-            target=asyncio.run, args=(self._start(),), name="WEBSERVER"
-        )
+
+        if self.workers == 1:
+            # Import SDKs in the background so the first request does not pay for it
+            warm_up(conf.LAZY_WARMUP_MODULES)
+
+            # Create a thread and run webserver inside it inside an event loop. _stop_threading_event
+            # is used to gracefully shutdown the thread.
+            self._thread = threading.Thread(
+                target=asyncio.run, args=(self._start(),), name="WEBSERVER"
+            )
+        else:
+            if "fork" not in multiprocessing.get_all_start_methods():
+                raise RuntimeError("Multiple workers require the fork start method.")
+
+            # Without SO_REUSEPORT the workers share one socket created before forking
+            if not hasattr(socket, "SO_REUSEPORT"):
+                self._listen_socket = self._create_socket()
+
+            self._heartbeats = multiprocessing.get_context("fork").Array(
+                "d", self.workers, lock=False
+            )
+            for worker_id in range(self.workers):
+                self._spawn_worker(worker_id)
+
+            logger.info(
+                "Server started %s workers on http://%s:%s",
+                self.workers,
+                self.address,
+                self.port,
+            )
+
+            # Supervisor thread restarts failed workers until the server is stopped
+            self._thread = threading.Thread(target=self._supervise, name="SUPERVISOR")
+
         self._thread.start()
         self.started = True
 
@@ -176,15 +429,36 @@ class Server:
         :return: None
         """
 
-        # Set the _stop_thread_event which triggers the coruutine hosting webserver to stop.
+        # Set the _stop_thread_event which triggers the coruutine hosting webserver (or the worker
+        # supervisor) to stop.
         self._stop_thread_event.set()
 
         # Wait for thread to terminate
         if self._thread is not None:
             self._thread.join()
 
+        self._processes = {}
         self.started = False
 
+    def worker_health(self) -> list:
+        """
+        Health of the worker processes.
+
+        :return: List of dictionaries with worker id, pid, liveness, seconds since last heartbeat and restart count
+        """
+
+        now = time.time()
+        return [
+            {
+                "worker": worker_id,
+                "pid": process.pid,
+                "alive": process.is_alive(),
+                "heartbeat_age": now - self._heartbeats[worker_id],
+                "restarts": self._restarts[worker_id],
+            }
+            for worker_id, process in sorted(self._processes.items())
+        ]
+
     def dump_apis(self, request):
         """
         Return available APIs in OpenAPI format
@@ -197,7 +471,7 @@ if __name__ == "__main__":
     # Example: Add/Update/Delete as required
 
     # Create a server and start it
-    ws = Server()
+    ws = Server(workers=conf.SERVER_WORKERS)
     ws.start()
 
     # Sample code to keep the server running
@@ -0,0 +1,387 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+from abc import ABC, abstractmethod
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "REGISTRY",
+    "instrument",
+]
+
+# Default latency buckets in seconds. Upstream model calls can take minutes, so buckets go up to 120s.
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Metric(ABC):
+    """
+    Base class for metrics. Values are kept per label set and updated under a lock, so metrics can be used
+    from the event loop and from threadpool threads.
+
+    With multiple worker processes every worker has its own registry, and /metrics reports the worker
+    which served the scrape. Its samples carry the constant labels of the registry, e.g. worker="0", so the
+    series of different workers do not overwrite each other and can be summed in queries.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        """
+        :param name: Metric name
+        :param documentation: Help text
+        :param labelnames: Names of the labels of the metric
+
+        :return: None
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self):
+        """
+        :return: Iterator of (suffix, labels, value)
+        """
+
+    def render(self, const_labels: dict = None) -> str:
+        """
+        Render the metric in the Prometheus text exposition format
+
+        :param const_labels: Labels added to every sample, e.g. {"worker": "0"}
+
+        :return: Metric as text
+        """
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self._samples():
+            if const_labels:
+                labels = {**const_labels, **labels}
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing counter
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    """
+    Value which can go up and down
+    """
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+        :param name: Metric name
+        :param documentation: Help text
+        :param labelnames: Names of the labels of the metric
+        :param buckets: Upper bounds of the buckets
+
+        :return: None
+        """
+
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts (last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def _samples(self):
+        with self._lock:
+            values = [
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield "_bucket", {**labels, "le": le}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    """
+    Collection of metrics which are exposed together
+    """
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # Labels added to every sample, e.g. the worker process
+        self.const_labels = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Register a metric. Registering a metric with the name of an existing one returns the existing one,
+        so modules can declare their metrics at import time.
+
+        :param metric: Metric to register
+
+        :return: Registered metric
+        """
+
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(
+                        f"{metric.name} already registered as {existing.type}"
+                    )
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format
+
+        :return: Metrics as text
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render(self.const_labels) for metric in metrics) + "\n"
+
+
+# Process wide registry exposed at /metrics
+REGISTRY = Registry()
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to upstream services",
+    ("upstream", "operation", "outcome"),
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors",
+    "Errors raised by calls to upstream services",
+    ("upstream", "operation", "error"),
+)
+
+
+def _record(upstream: str, operation: str, start: float, error: Exception) -> None:
+    UPSTREAM_LATENCY.observe(
+        time.perf_counter() - start,
+        upstream=upstream,
+        operation=operation,
+        outcome="success" if error is None else "error",
+    )
+    if error is not None:
+        UPSTREAM_ERRORS.inc(
+            upstream=upstream, operation=operation, error=type(error).__name__
+        )
+
+
+def instrument(upstream: str, operation: str = None):
+    """
+    Decorator which records latency and errors of an upstream call in the upstream metrics. Works with
+    functions, coroutines, generators and async generators. Streams are timed until they are exhausted.
+
+    Example:
+        @instrument("TextModel")
+        def predict(self, prompt): ...
+
+    :param upstream: Name of the upstream, e.g. the class wrapping it
+    :param operation: Name of the operation. Defaults to the function name.
+
+    :return: Decorator
+    """
+
+    def decorator(func):
+        op = operation or func.__name__
+
+        if inspect.isasyncgenfunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except GeneratorExit:
+                    # Consumer stopped reading the stream early, not an upstream error
+                    raise
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _record(upstream, op, start, error)
+
+        elif inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    yield from func(*args, **kwargs)
+                except GeneratorExit:
+                    # Consumer stopped reading the stream early, not an upstream error
+                    raise
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _record(upstream, op, start, error)
+
+        elif inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _record(upstream, op, start, error)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    return func(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _record(upstream, op, start, error)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,181 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import asyncio
+import collections
+
+from logger.logging import Logger
+from metrics.metrics import REGISTRY
+from starlette.responses import JSONResponse
+
+__all__ = ["AdmissionController", "AdmissionControlMiddleware", "Rejected"]
+
+# Create logger object
+logger = Logger(__name__)
+
+IN_FLIGHT = REGISTRY.gauge(
+    "admission_in_flight", "Requests holding an admission slot", ("route",)
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "admission_queue_depth", "Requests waiting for an admission slot", ("route",)
+)
+SHED = REGISTRY.counter(
+    "admission_shed", "Requests rejected by admission control", ("route", "reason")
+)
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of concurrent requests. Requests over the limit wait in a bounded FIFO queue; when the
+    queue is full they are rejected immediately with 429, and when they wait longer than queue_timeout they
+    are rejected with 503.
+
+    Limits apply per worker process.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int = 0,
+        queue_timeout: float = 5.0,
+        retry_after: int = 1,
+        name: str = "",
+    ) -> None:
+        """
+        :param max_concurrency: Maximum number of requests handled concurrently
+        :param max_queue: Maximum number of requests waiting for a slot. 0 rejects as soon as all slots are taken.
+        :param queue_timeout: Seconds a request may wait for a slot
+        :param retry_after: Value of the Retry-After header of rejections, in seconds
+        :param name: Name used as route label in metrics
+
+        :return: None
+        """
+
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.name = name
+
+        self._in_flight = 0
+        self._waiters = collections.deque()
+
+    def _update_metrics(self) -> None:
+        IN_FLIGHT.set(self._in_flight, route=self.name)
+        QUEUE_DEPTH.set(len(self._waiters), route=self.name)
+
+    def _reject(self, status_code: int, reason: str) -> Rejected:
+        SHED.inc(route=self.name, reason=reason)
+        logger.warning("Request to %s rejected: %s", self.name, reason)
+        return Rejected(status_code, reason, self.retry_after)
+
+    async def acquire(self) -> None:
+        """
+        Wait for a slot.
+
+        :return: None. Raises Rejected if the request is not admitted.
+        """
+
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            self._update_metrics()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(429, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_metrics()
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # The slot may have been handed over just as the wait ended, give it back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(503, "queue_timeout")
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._update_metrics()
+
+    def release(self) -> None:
+        """
+        Release a slot, handing it over to the oldest waiting request if there is one.
+
+        :return: None
+        """
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_metrics()
+                return
+
+        self._in_flight -= 1
+        self._update_metrics()
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware applying an AdmissionController per route path. A slot is held until the response,
+    including streamed responses, is completely sent.
+    """
+
+    def __init__(self, app, limits: dict) -> None:
+        """
+        :param app: ASGI application
+        :param limits: Dictionary of route path to AdmissionController keyword arguments, e.g.
+            {"/process": {"max_concurrency": 64, "max_queue": 128, "queue_timeout": 10}}
+
+        :return: None
+        """
+
+        self.app = app
+        self.controllers = {
+            path: AdmissionController(name=path, **kwargs)
+            for path, kwargs in limits.items()
+        }
+
+    async def __call__(self, scope, receive, send) -> None:
+        controller = None
+        if scope["type"] == "http":
+            controller = self.controllers.get(scope["path"])
+
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await controller.acquire()
+        except Rejected as e:
+            response = JSONResponse(
+                {"error": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release()
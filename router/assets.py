@@ -0,0 +1,153 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+import tempfile
+
+import anyio
+from logger.logging import Logger
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, assets are only gzip compressed without it
+    brotli = None
+
+__all__ = ["build_assets", "PrecompressedStaticFiles"]
+
+# Create logger object
+logger = Logger(__name__)
+
+# Sub directory of the static directory holding fingerprinted assets
+BUILD_DIR = "build"
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+
+def _write(path: str, data: bytes) -> None:
+    """
+    Atomically write a file. Fingerprinted files never change, so existing files are kept.
+    """
+
+    if os.path.exists(path):
+        return
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _write_asset(static_dir: str, name: str, extension: str, data: bytes) -> str:
+    """
+    Write a content hashed asset together with its gzip and brotli encoded variants.
+
+    :param static_dir: Static directory
+    :param name: Base name of the asset
+    :param extension: File extension of the asset
+    :param data: Content of the asset
+
+    :return: Path of the asset relative to static_dir
+    """
+
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    relative_path = f"{BUILD_DIR}/{name}.{digest}.{extension}"
+    path = os.path.join(static_dir, relative_path)
+
+    _write(path, data)
+    if len(data) >= MIN_COMPRESS_SIZE:
+        _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + ".br", brotli.compress(data, quality=11))
+
+    return relative_path
+
+
+def build_assets(ui, static_dir: str, name: str = "ui") -> dict:
+    """
+    Extract the JS and CSS of a UI into content hashed static files.
+
+    :param ui: UI instance
+    :param static_dir: Static directory served by PrecompressedStaticFiles
+    :param name: Base name of the asset files
+
+    :return: Dictionary with "js" and "css" paths relative to static_dir
+    """
+
+    os.makedirs(os.path.join(static_dir, BUILD_DIR), exist_ok=True)
+
+    assets = {
+        "js": _write_asset(static_dir, name, "js", str(ui.js()).encode("utf-8")),
+        "css": _write_asset(static_dir, name, "css", str(ui.css()).encode("utf-8")),
+    }
+    logger.info("Built UI assets: %s", assets)
+
+    return assets
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles which serves precompressed .br/.gz variants when the client accepts them and sets
+    Cache-Control. Fingerprinted files under build/ are cached forever as immutable, other files for max_age.
+    """
+
+    def __init__(self, *args, max_age: int = 3600, **kwargs) -> None:
+        """
+        :param max_age: Seconds browsers may cache files which are not fingerprinted
+
+        :return: None
+        """
+
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+
+    async def get_response(self, path: str, scope):
+        fingerprinted = path.startswith(BUILD_DIR + "/")
+        response = None
+
+        if fingerprinted:
+            accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if encoding not in accept_encoding:
+                    continue
+
+                full_path, stat_result = await anyio.to_thread.run_sync(
+                    self.lookup_path, path + suffix
+                )
+                if stat_result and stat.S_ISREG(stat_result.st_mode):
+                    response = self.file_response(full_path, stat_result, scope)
+                    response.headers["content-encoding"] = encoding
+                    response.headers["content-type"] = (
+                        mimetypes.guess_type(path)[0] or "application/octet-stream"
+                    )
+                    break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            if fingerprinted:
+                response.headers["cache-control"] = (
+                    "public, max-age=31536000, immutable"
+                )
+                response.headers["vary"] = "Accept-Encoding"
+            else:
+                response.headers["cache-control"] = f"public, max-age={self.max_age}"
+
+        return response
+
+
+if __name__ == "__main__":
+    # Build the assets ahead of time, e.g. while building the container image
+    from router.ui import UIEndPoint
+
+    UIEndPoint().render()
@@ -0,0 +1,75 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import asyncio
+
+from metrics.metrics import REGISTRY
+
+__all__ = ["SingleFlight"]
+
+COALESCED = REGISTRY.counter(
+    "coalesced_requests",
+    "Requests which shared the in-flight computation of an identical request",
+    ("handler",),
+)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the computation, callers arriving
+    while it is in flight wait for it and receive the same result (or exception). Once it completes the key
+    is forgotten, so later calls compute again.
+
+    A caller which is cancelled (e.g. its client disconnected) stops waiting without cancelling the
+    computation other callers are waiting for. When the last waiting caller is cancelled the computation is
+    cancelled too.
+    """
+
+    def __init__(self, name: str = "") -> None:
+        """
+        :param name: Name used as handler label in metrics
+
+        :return: None
+        """
+
+        self.name = name
+        self._calls = {}
+        self._waiters = {}
+
+    async def do(self, key, func, *args):
+        """
+        Run func(*args) unless a call with the same key is in flight, in which case wait for that one.
+
+        :param key: Hashable key identifying identical calls
+        :param func: Coroutine function
+        :param args: Arguments of func
+
+        :return: Result of the call
+        """
+
+        task = self._calls.get(key)
+        if task is not None:
+            COALESCED.inc(handler=self.name)
+        else:
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Nobody is left waiting for the result
+            if self._waiters.get(task) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _forget(self, key, task) -> None:
+        self._calls.pop(key, None)
+        self._waiters.pop(task, None)
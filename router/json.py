@@ -3,51 +3,358 @@ Copyright 2023 Google. This software is provided as-is, without warranty or repr
 Your use of it is subject to your agreement with Google.
 """
 
-import json
-import random
+import asyncio
+import hashlib
+import inspect
 
-from logger.logging import Logger
-from starlette.responses import PlainTextResponse
+from cache.backends import CacheBackend
+from logger.logging import DEBUG, Logger, set_request_id
+from metrics.metrics import REGISTRY
+from router.coalescing import SingleFlight
+from router.serialization import JSONSerializer, get_serializer
+from router.streaming import stream_format, streaming_response
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.requests import ClientDisconnect
+from starlette.responses import Response
 
 __all__ = ["JSONEndPoint"]
 
 # Create logger object
 logger = Logger(__name__)
 
+CACHE_REQUESTS = REGISTRY.counter(
+    "response_cache_requests", "Response cache lookups", ("handler", "result")
+)
+
+# Binary types, passed to process() as they are received
+_BINARY = (bytes, bytearray, memoryview)
+
+
+async def _wait_for_disconnect(request) -> None:
+    """
+    Return when the client of a request whose body was already read disconnects
+    """
+
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _loggable(request_body):
+    """
+    Request with binary fields replaced by their size, for logging
+    """
+
+    if not isinstance(request_body, dict):
+        return request_body
+    return {
+        name: f"<{len(value)} bytes>" if isinstance(value, _BINARY) else value
+        for name, value in request_body.items()
+    }
+
 
 class JSONEndPoint:
     """
     Sample endpoint that can be replicated to meet any customer requirement. Update the code as required.
-    request_body = await request.json() will capture the JSON query from the user and can be passed for further processing.
-    response can be a dictionary which is converted to JSON and eventually to HTTP response using PlainTextResponse() function.
+    The JSON query from the user is decoded and passed to process() for further processing.
+    response can be a dictionary which is converted to JSON by the serializer and returned as an application/json response.
+
+    Clients which send "Accept: text/event-stream" or "Accept: application/x-ndjson" (or the "stream=sse|ndjson"
+    query parameter) receive the chunks yielded by process_stream() as Server-Sent Events or newline-delimited JSON.
+
+    process() can be a coroutine function awaiting async backend calls (e.g. TextModel.apredict), otherwise it
+    runs in the threadpool. When the client disconnects before the response is ready the computation is
+    cancelled, and with a timeout requests taking longer are answered with 504 Gateway Timeout.
+
+    Concurrent requests with identical JSON bodies (ignoring key order) share one call of process() and all
+    receive its response. Disable coalescing for handlers whose response must not be shared, e.g. ones with
+    side effects or per-user state.
+
+    With a cache, responses are stored for cache_ttl seconds keyed by handler name and request body. Clients
+    can opt out per request with "Cache-Control: no-cache" (do not read from the cache) or "no-store" (neither
+    read nor write). Responses carry an X-Cache header with HIT or MISS.
+
+    Besides JSON, images and other files can be uploaded without base64 encoding, and reach process() as
+    bytes which the backends (MultiModel.predict, ImageModel.edit_image) use without a copy:
+    - multipart/form-data: files are bytes fields and other fields strings of the request dictionary.
+    - Raw body with an image/* or application/octet-stream Content-Type: the body is the upload_field field and
+      the query parameters the other fields, e.g. POST /process?prompt=Describe with the image as body.
     """
 
+    def __init__(
+        self,
+        serializer: JSONSerializer = None,
+        coalesce: bool = True,
+        name: str = None,
+        cache: CacheBackend = None,
+        cache_ttl: float = 300,
+        timeout: float = None,
+        upload_field: str = "image",
+    ):
+        """
+        :param serializer: JSON serializer used to decode requests and encode responses. Defaults to orjson
+            when it is installed, otherwise the standard library.
+        :param coalesce: Share one computation between concurrent identical requests. Default is True.
+        :param name: Handler name used in metrics and cache keys. Default is the class name.
+        :param cache: Response cache backend. Default is None, i.e. responses are not cached.
+        :param cache_ttl: Seconds responses of this handler stay cached. Default is 300.
+        :param timeout: Seconds to wait for process(). Default is None, i.e. no timeout.
+        :param upload_field: Request field of raw body uploads. Default is "image".
+
+        :return:
+        """
+
+        self.serializer = serializer or get_serializer()
+        self.coalesce = coalesce
+        self.name = name or type(self).__name__
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.upload_field = upload_field
+        self._single_flight = SingleFlight(self.name)
+
     async def get_request(self, request) -> str:
         """
         responses:
             200:
-                description: A json output. ### Update as required
+                description: A json output, or a stream of json chunks when streaming is requested. ### Update as required
                 examples:
                     {"key1": "value1", "key2": "value2"} ### Update as required
         """
 
         # User request data
-        request_body = await request.json()
+        request_body = await self._read_body(request)
 
-        # Generate a random request ID for tracking
-        request_id = random.randint(1000000, 9999999)
+        # Request ID for tracking, taken from the client or generated. It is added to every log record of the
+        # request and returned in the X-Request-ID header.
+        request_id = set_request_id(request.headers.get("x-request-id"))
 
         # Log input request for debugging
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(
+                "HTTP Request - ID: %s URL: %s Method: %s JSON: %s",
+                request_id,
+                request.url,
+                request.method,
+                _loggable(request_body),
+                event="http_request",
+            )
+
+        # Stream response chunks as they are generated
+        fmt = stream_format(request)
+        if fmt:
+            logger.debug("HTTP Response - ID: %s Streaming: %s", request_id, fmt)
+            response = streaming_response(
+                self.process_stream(request_body), fmt, self.serializer
+            )
+            response.headers["X-Request-ID"] = request_id
+            return response
+
+        key = None
+        if self.coalesce or self.cache is not None:
+            key = self._request_key(request_body)
+
+        # Cache opt-out of the client
+        cache_control = request.headers.get("cache-control", "")
+        cache_write = self.cache is not None and "no-store" not in cache_control
+        cache_read = cache_write and "no-cache" not in cache_control
+
+        if cache_read:
+            body = await self._cache_call(self.cache.get, f"{self.name}:{key}")
+            CACHE_REQUESTS.inc(
+                handler=self.name, result="miss" if body is None else "hit"
+            )
+            if body is not None:
+                logger.debug("HTTP Response - ID: %s Cache: HIT", request_id)
+                return Response(
+                    body,
+                    media_type=self.serializer.media_type,
+                    headers={"X-Cache": "HIT", "X-Request-ID": request_id},
+                )
+
+        if self.coalesce:
+            computation = self._single_flight.do(key, self._respond, request_body)
+        else:
+            computation = self._respond(request_body)
+
+        try:
+            response, body = await self._cancel_on_disconnect(request, computation)
+        except asyncio.TimeoutError:
+            logger.error("HTTP Response - ID: %s timed out.", request_id)
+            return Response(status_code=504, headers={"X-Request-ID": request_id})
+        except ClientDisconnect:
+            logger.info("HTTP Response - ID: %s client disconnected.", request_id)
+            return Response(status_code=499, headers={"X-Request-ID": request_id})
+
+        if cache_write:
+            await self._cache_call(
+                self.cache.set, f"{self.name}:{key}", body, self.cache_ttl
+            )
+
+        # Log response for debugging
         logger.debug(
-            f"HTTP Request - ID: {request_id} URL: {request.url} Method: {request.method} JSON: {request_body}"
+            "HTTP Response - ID: %s JSON: %s",
+            request_id,
+            response,
+            event="http_response",
         )
 
+        headers = {"X-Request-ID": request_id}
+        if self.cache is not None:
+            headers["X-Cache"] = "MISS"
+        return Response(body, media_type=self.serializer.media_type, headers=headers)
+
+    async def _read_body(self, request):
+        """
+        Decode the request body, JSON or a binary upload
+
+        :param request: HTTP request
+
+        :return: Request dictionary (or other JSON value)
+        """
+
+        media_type = request.headers.get("content-type", "").split(";")[0].strip()
+        if media_type == "multipart/form-data":
+            form = await request.form()
+            try:
+                request_body = {}
+                for name, value in form.multi_items():
+                    if isinstance(value, UploadFile):
+                        value = await value.read()
+                    request_body[name] = value
+            finally:
+                await form.close()
+            return request_body
+
+        if media_type.startswith("image/") or media_type == "application/octet-stream":
+            request_body = dict(request.query_params)
+            request_body[self.upload_field] = await request.body()
+            return request_body
+
+        return self.serializer.loads(await request.body())
+
+    def _request_key(self, request_body) -> str:
+        """
+        Key of identical requests, binary fields are hashed without serializing them
+
+        :param request_body: Request from the user
+
+        :return: Hex digest
+        """
+
+        if isinstance(request_body, dict) and any(
+            isinstance(value, _BINARY) for value in request_body.values()
+        ):
+            request_body = {
+                name: (
+                    {"sha256": hashlib.sha256(value).hexdigest()}
+                    if isinstance(value, _BINARY)
+                    else value
+                )
+                for name, value in request_body.items()
+            }
+        return hashlib.sha256(self.serializer.canonical(request_body)).hexdigest()
+
+    async def _respond(self, request_body: dict) -> tuple:
+        """
+        Process the request and serialize the response
+
+        :param request_body: JSON request from the user
+
+        :return: Tuple of response dictionary and serialized response
+        """
+
+        if inspect.iscoroutinefunction(self.process):
+            computation = self.process(request_body)
+        else:
+            # Blocking backend calls run in the threadpool to keep the event loop free
+            computation = run_in_threadpool(self.process, request_body)
+        response = await asyncio.wait_for(computation, self.timeout)
+
+        return response, self.serializer.dumps(response)
+
+    @staticmethod
+    async def _cancel_on_disconnect(request, computation):
+        """
+        Await the computation, cancelling it when the client disconnects first
+
+        :param request: HTTP request, its body must already be read
+        :param computation: Awaitable computing the response
+
+        :return: Result of the computation
+        """
+
+        task = asyncio.ensure_future(computation)
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        try:
+            await asyncio.wait((task, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Also reached when the handler itself is cancelled
+            disconnect.cancel()
+            if not task.done():
+                task.cancel()
+
+        if not task.done():
+            raise ClientDisconnect()
+        return task.result()
+
+    async def _cache_call(self, func, *args):
+        """
+        Call a cache backend method, in the threadpool if the backend does blocking I/O
+        """
+
+        try:
+            if self.cache.blocking:
+                return await run_in_threadpool(func, *args)
+            return func(*args)
+        except Exception as e:
+            # The cache is an optimisation, requests are served without it when it fails
+            logger.error("Response cache failed: %s.", e)
+            return None
+
+    def process(self, request_body: dict) -> dict:
+        """
+        Process the request and return the response
+
+        :param request_body: JSON request from the user, with bytes fields for uploaded files
+
+        :return: Response dictionary
+        """
+
         #####################################################
         # EXAMPLE: Update this section to perform any function and then return the response.
+        # process can also be a coroutine function awaiting async backend calls, e.g.
+        #     async def process(self, request_body):
+        #         text = await TextModel("gemini-1.5-flash-001").apredict(request_body["prompt"], timeout=30)
+        #         return {"text": text}
+        # Uploaded images are bytes, which MultiModel.predict and ImageModel.edit_image take as they are, e.g.
+        #     text = MultiModel("gemini-1.5-flash-001").predict(request_body["prompt"], request_body["image"])
         response = {}
         #####################################################
 
-        # Log response for debugging
-        logger.debug(f"HTTP Response - ID: {request_id} JSON: {response}")
+        return response
+
+    async def process_stream(self, request_body: dict):
+        """
+        Process the request and yield response chunks as they are generated
+
+        :param request_body: JSON request from the user
 
-        return PlainTextResponse(json.dumps(response))
+        :return: Iterator (or async iterator) of response dictionaries
+        """
+
+        #####################################################
+        # EXAMPLE: Update this section to stream chunks from the backend, e.g.
+        #     stream = TextModel("gemini-1.5-flash-001").predict_stream(request_body["prompt"])
+        #     for text in stream:
+        #         yield {"text": text}
+        #     yield {"usage": stream.usage_metadata}
+        # process_stream can also be an async generator iterating TextModel.apredict_stream() with async for.
+        # By default the whole response of process() is sent as a single chunk.
+        if inspect.iscoroutinefunction(self.process):
+            yield await self.process(request_body)
+        else:
+            yield await run_in_threadpool(self.process, request_body)
+        #####################################################
@@ -0,0 +1,99 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import time
+
+from metrics.metrics import REGISTRY, Registry
+from starlette.responses import Response
+from starlette.routing import Match
+
+__all__ = ["MetricsEndPoint", "MetricsMiddleware"]
+
+REQUESTS = REGISTRY.counter(
+    "http_requests", "HTTP requests handled", ("route", "method", "status")
+)
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests until the response is fully sent",
+    ("route", "method"),
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled", ("route",)
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count, latency and in-flight requests per route. Requests are labelled
+    with the path of the matching route (e.g. "/static" for any static file) to keep label cardinality bounded.
+    """
+
+    def __init__(self, app, routes: list) -> None:
+        """
+        :param app: ASGI application
+        :param routes: Routes of the application, used to label requests
+
+        :return: None
+        """
+
+        self.app = app
+        self.routes = routes
+
+    def _route(self, scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        method = scope["method"]
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec(route=route)
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start, route=route, method=method
+            )
+            REQUESTS.inc(route=route, method=method, status=status)
+
+
+class MetricsEndPoint:
+    """
+    Exposes the metrics registry in the Prometheus text exposition format
+    """
+
+    def __init__(self, registry: Registry = REGISTRY):
+        """
+        :param registry: Registry to expose
+
+        :return:
+        """
+
+        self.registry = registry
+
+    async def get_request(self, request):
+        """
+        responses:
+            200:
+                description: Metrics in Prometheus text format.
+        """
+
+        return Response(self.registry.render(), media_type="text/plain; version=0.0.4")
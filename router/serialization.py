@@ -0,0 +1,104 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, stdlib json is used when it is not installed
+    orjson = None
+
+__all__ = ["JSONSerializer", "ORJSONSerializer", "get_serializer"]
+
+
+class JSONSerializer:
+    """
+    Standard library JSON serializer. Encodes to UTF-8 bytes so the result can be sent as the HTTP body
+    without another copy.
+    """
+
+    name = "json"
+    media_type = "application/json"
+
+    def dumps(self, obj) -> bytes:
+        """
+        Serialize an object to JSON
+
+        :param obj: JSON serialisable object
+
+        :return: UTF-8 encoded JSON
+        """
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    def canonical(self, obj) -> bytes:
+        """
+        Serialize an object to canonical JSON with sorted keys, so that equal objects give equal bytes.
+        Used to build keys for identical requests.
+
+        :param obj: JSON serialisable object
+
+        :return: UTF-8 encoded JSON
+        """
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True
+        ).encode("utf-8")
+
+    def loads(self, data: bytes):
+        """
+        Deserialize JSON
+
+        :param data: JSON as bytes or str
+
+        :return: Deserialized object
+        """
+        return json.loads(data)
+
+
+class ORJSONSerializer(JSONSerializer):
+    """
+    orjson based serializer. Several times faster than the standard library for large payloads such as
+    base64 encoded images, and produces bytes directly.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError("orjson is not installed. Run: pip install orjson")
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def canonical(self, obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+
+SERIALIZERS = {
+    JSONSerializer.name: JSONSerializer,
+    ORJSONSerializer.name: ORJSONSerializer,
+}
+
+
+def get_serializer(name: str = "auto") -> JSONSerializer:
+    """
+    Get a JSON serializer by name.
+
+    :param name: "json", "orjson" or "auto" which picks orjson when it is installed
+
+    :return: Serializer instance
+    """
+
+    if name == "auto":
+        name = ORJSONSerializer.name if orjson is not None else JSONSerializer.name
+
+    if name not in SERIALIZERS:
+        raise ValueError(f"{name} serializer not supported.")
+
+    return SERIALIZERS[name]()
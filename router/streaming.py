@@ -0,0 +1,120 @@
+"""
+Copyright 2023 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+
+import inspect
+
+from logger.logging import Logger
+from router.serialization import JSONSerializer, get_serializer
+from starlette.responses import StreamingResponse
+
+__all__ = ["stream_format", "streaming_response", "SSE", "NDJSON"]
+
+# Create logger object
+logger = Logger(__name__)
+
+# Supported streaming formats and their media types
+SSE = "sse"
+NDJSON = "ndjson"
+MEDIA_TYPES = {SSE: "text/event-stream", NDJSON: "application/x-ndjson"}
+
+
+def stream_format(request) -> str:
+    """
+    Streaming format requested by the client, either through the "stream" query parameter (sse or ndjson)
+    or through the Accept header.
+
+    :param request: Starlette request
+
+    :return: SSE, NDJSON or None when a regular JSON response is expected
+    """
+
+    requested = request.query_params.get("stream")
+    if requested in MEDIA_TYPES:
+        return requested
+
+    accept = request.headers.get("accept", "")
+    for name, media_type in MEDIA_TYPES.items():
+        if media_type in accept:
+            return name
+
+    return None
+
+
+def _encode(chunk, fmt: str, serializer: JSONSerializer, event: str = None) -> bytes:
+    """
+    Encode a single chunk for the wire.
+
+    :param chunk: JSON serialisable chunk
+    :param fmt: SSE or NDJSON
+    :param serializer: JSON serializer
+    :param event: Optional SSE event name
+
+    :return: Encoded chunk
+    """
+
+    data = serializer.dumps(chunk)
+    if fmt == NDJSON:
+        return data + b"\n"
+
+    prefix = f"event: {event}\n".encode("utf-8") if event else b""
+    return prefix + b"data: " + data + b"\n\n"
+
+
+def _error(e: Exception, fmt: str, serializer: JSONSerializer) -> bytes:
+    """
+    Encode an error raised after the response has started. Status code is already sent at that point,
+    so the error is reported in-band.
+    """
+
+    logger.error("Streaming response failed: %s.", e)
+    return _encode({"error": str(e)}, fmt, serializer, event="error")
+
+
+def streaming_response(
+    chunks, fmt: str, serializer: JSONSerializer = None
+) -> StreamingResponse:
+    """
+    Create a streaming HTTP response which forwards chunks as soon as they are produced.
+
+    Sync iterators (e.g. TextModel.predict_stream()) are consumed in the threadpool so they do not block
+    the event loop, async iterators are consumed on the event loop.
+
+    :param chunks: Iterator or async iterator of JSON serialisable chunks
+    :param fmt: SSE or NDJSON
+    :param serializer: JSON serializer. Defaults to get_serializer()
+
+    :return: StreamingResponse
+    """
+
+    serializer = serializer or get_serializer()
+
+    if inspect.isasyncgen(chunks) or hasattr(chunks, "__aiter__"):
+
+        async def body():
+            try:
+                async for chunk in chunks:
+                    yield _encode(chunk, fmt, serializer)
+            except Exception as e:
+                yield _error(e, fmt, serializer)
+            else:
+                if fmt == SSE:
+                    yield _encode({}, fmt, serializer, event="end")
+
+    else:
+
+        def body():
+            try:
+                for chunk in chunks:
+                    yield _encode(chunk, fmt, serializer)
+            except Exception as e:
+                yield _error(e, fmt, serializer)
+            else:
+                if fmt == SSE:
+                    yield _encode({}, fmt, serializer, event="end")
+
+    # Disable caching and proxy buffering so chunks reach the client immediately
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[fmt], headers=headers)
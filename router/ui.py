@@ -3,11 +3,14 @@ Copyright 2023 Google. This software is provided as-is, without warranty or repr
 Your use of it is subject to your agreement with Google.
 """
 
+import hashlib
 import os
 
 from fastapi.templating import Jinja2Templates
 from frontend.ui.base import UI
-from logger.logging import Logger
+from logger.logging import DEBUG, Logger
+from router.assets import build_assets
+from starlette.responses import Response
 
 __all__ = ["UIEndPoint"]
 
@@ -16,9 +19,22 @@ logger = Logger(__name__)
 
 
 class UIEndPoint:
+    """
+    Serves the UI page. Output of a UI is static for its constructor arguments, so the page is rendered once,
+    cached with a content hash ETag and served with Cache-Control. Requests with a matching If-None-Match
+    header get an empty 304 response.
+
+    The JS and CSS of the UI are extracted into fingerprinted, precompressed files under the static directory
+    so browsers cache them independently of the page.
+    """
+
     # Initialise variables
-    def __init__(self):
+    def __init__(self, max_age: int = 0, static_dir: str = None):
         """
+        :param max_age: Seconds browsers may use the page without revalidating. Default is 0, i.e. always
+            revalidate with If-None-Match which is cheap due to the ETag.
+        :param static_dir: Static directory mounted at /static. Default is frontend/static.
+
         :return:
         """
 
@@ -30,31 +46,74 @@ class UIEndPoint:
         template_dir = os.path.join(os.path.dirname(__file__), "../frontend/templates")
         self.templates = Jinja2Templates(directory=template_dir)
 
-    async def get_request(self, request):
+        self.max_age = max_age
+        self.static_dir = static_dir or os.path.join(
+            os.path.dirname(__file__), "../frontend/static"
+        )
+
+        # Rendered page and its ETag, populated on first request by render()
+        self._body = None
+        self._etag = None
+
+    def render(self) -> bytes:
         """
-        responses:
-            200:
-                description: UI for demo. ### Update as required
+        Render the page once and cache it. Can be called at startup to pre-render.
+
+        :return: Rendered page
         """
 
-        # Log request for debugging
-        logger.debug(f"HTTP Request - ID: {request.id}  Method: {request.method}")
+        if self._body is not None:
+            return self._body
 
         # Get data from the UI
         html = str(self.ui.html())
-        css = str(self.ui.css())
         css_references = str(self.ui.css_references())
-        js = str(self.ui.js())
         js_references = str(self.ui.js_references())
 
-        return self.templates.TemplateResponse(
-            "base.html",
-            {
-                "request": request,
-                "html": html,
-                "css": css,
-                "css_references": css_references,
-                "js": js,
-                "js_references": js_references,
-            },
+        # JS and CSS are served as fingerprinted static files
+        assets = build_assets(self.ui, self.static_dir)
+
+        body = (
+            self.templates.get_template("base.html")
+            .render(
+                html=html,
+                css_url=f"static/{assets['css']}",
+                css_references=css_references,
+                js_url=f"static/{assets['js']}",
+                js_references=js_references,
+            )
+            .encode("utf-8")
         )
+
+        self._etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self._body = body
+
+        return self._body
+
+    async def get_request(self, request):
+        """
+        responses:
+            200:
+                description: UI for demo. ### Update as required
+            304:
+                description: UI not modified since the version identified by If-None-Match.
+        """
+
+        # Log request for debugging
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(
+                "HTTP Request - URL: %s Method: %s", request.url, request.method
+            )
+
+        body = self.render()
+        headers = {
+            "ETag": self._etag,
+            "Cache-Control": f"public, max-age={self.max_age}, must-revalidate",
+        }
+
+        # Browser already has this version of the page
+        if_none_match = request.headers.get("if-none-match", "")
+        if self._etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        return Response(body, media_type="text/html", headers=headers)
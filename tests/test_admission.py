@@ -0,0 +1,102 @@
+"""
+Admission control: bounded concurrency, bounded queue, 429 and 503 rejections
+"""
+
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from router.admission import AdmissionControlMiddleware, AdmissionController, Rejected
+
+
+def test_requests_over_the_limit_wait_for_a_released_slot():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        await controller.acquire()
+        waiting = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        controller.release()
+        await waiting
+        controller.release()
+        return controller._in_flight
+
+    assert asyncio.run(main()) == 0
+
+
+def test_full_queue_is_rejected_with_429():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=0, retry_after=3)
+        await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        return rejected.value
+
+    rejected = asyncio.run(main())
+    assert rejected.status_code == 429
+    assert rejected.reason == "queue_full"
+    assert rejected.retry_after == 3
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def main():
+        controller = AdmissionController(
+            max_concurrency=1, max_queue=1, queue_timeout=0.01
+        )
+        await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        return rejected.value, len(controller._waiters)
+
+    rejected, waiters = asyncio.run(main())
+    assert rejected.status_code == 503
+    assert rejected.reason == "queue_timeout"
+    assert waiters == 0
+
+
+def test_middleware_answers_rejections_with_retry_after():
+    release = asyncio.Event()
+
+    async def slow(request):
+        await release.wait()
+        return JSONResponse({"ok": True})
+
+    app = AdmissionControlMiddleware(
+        Starlette(routes=[Route("/process", slow)]),
+        {"/process": {"max_concurrency": 1, "max_queue": 0, "retry_after": 2}},
+    )
+
+    async def request(path):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [],
+        }
+        await app(scope, receive, send)
+        return messages[0]
+
+    async def main():
+        first = asyncio.ensure_future(request("/process"))
+        await asyncio.sleep(0.01)
+        rejected = await request("/process")
+        release.set()
+        return rejected, await first
+
+    rejected, admitted = asyncio.run(main())
+    assert rejected["status"] == 429
+    assert (b"retry-after", b"2") in rejected["headers"]
+    assert admitted["status"] == 200
@@ -0,0 +1,106 @@
+"""
+Memory and SQLite response cache backends: TTL, LRU and size eviction, sharing between processes
+"""
+
+import multiprocessing
+
+import pytest
+
+from cache import backends
+from cache.backends import MemoryCache, SQLiteCache, create_cache
+
+
+class Clock:
+    """Replaces time.time() of the cache module"""
+
+    def __init__(self, monkeypatch, now: float = 1000.0):
+        self.now = now
+        monkeypatch.setattr(backends.time, "time", lambda: self.now)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return create_cache("memory")
+    return create_cache("sqlite", path=str(tmp_path / "cache.sqlite"))
+
+
+def test_entries_expire_after_their_ttl(cache, monkeypatch):
+    clock = Clock(monkeypatch)
+    cache.set("short", b"1", ttl=10)
+    cache.set("forever", b"2")
+
+    clock.now += 9
+    assert cache.get("short") == b"1"
+    clock.now += 2
+    assert cache.get("short") is None
+    assert cache.get("forever") == b"2"
+
+
+def test_delete_and_clear(cache):
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+
+    cache.delete("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_memory_cache_evicts_least_recently_used_entries():
+    cache = MemoryCache(max_entries=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.get("a")
+    cache.set("c", b"3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_memory_cache_is_bounded_by_bytes():
+    cache = MemoryCache(max_bytes=10)
+    cache.set("a", b"x" * 6)
+    cache.set("b", b"y" * 6)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == b"y" * 6
+
+    # Values larger than the whole cache are not stored
+    cache.set("c", b"z" * 11)
+    assert cache.get("c") is None
+    assert cache.get("b") == b"y" * 6
+
+
+def test_sqlite_cache_evicts_least_recently_used_entries(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    monkeypatch.setattr(SQLiteCache, "EVICT_EVERY", 1)
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        clock.now += 1
+        cache.set(key, key.encode())
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.set("c", b"c")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a"
+    assert cache.get("c") == b"c"
+
+
+def _write(path: str) -> None:
+    SQLiteCache(path).set("shared", b"from another process", ttl=60)
+
+
+def test_sqlite_cache_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path)
+
+    process = multiprocessing.get_context("spawn").Process(target=_write, args=(path,))
+    process.start()
+    process.join(30)
+
+    assert process.exitcode == 0
+    assert cache.get("shared") == b"from another process"
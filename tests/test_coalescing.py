@@ -0,0 +1,93 @@
+"""
+SingleFlight coalescing of identical concurrent calls
+"""
+
+import asyncio
+
+import pytest
+
+from router.coalescing import SingleFlight
+
+
+class Computation:
+    """Coroutine function which waits for release and counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self, value):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def test_concurrent_identical_calls_share_one_computation():
+    async def main():
+        flight, func = SingleFlight("test"), Computation()
+        callers = [asyncio.ensure_future(flight.do("k", func, "v")) for _ in range(3)]
+        await asyncio.sleep(0)
+        func.release.set()
+        return await asyncio.gather(*callers), func.calls
+
+    results, calls = asyncio.run(main())
+    assert results == ["v", "v", "v"]
+    assert calls == 1
+
+
+def test_exception_is_shared_and_later_calls_compute_again():
+    async def main():
+        flight, func = SingleFlight("test"), Computation()
+        callers = [
+            asyncio.ensure_future(flight.do("k", func, ValueError("bad")))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        func.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert await flight.do("k", func, "again") == "again"
+        return results, func.calls
+
+    results, calls = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight, func = SingleFlight("test"), Computation()
+        first = asyncio.ensure_future(flight.do("k", func, "v"))
+        second = asyncio.ensure_future(flight.do("k", func, "v"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        func.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, func.cancelled
+
+    result, cancelled = asyncio.run(main())
+    assert result == "v"
+    assert not cancelled
+
+
+def test_computation_is_cancelled_with_its_last_caller():
+    async def main():
+        flight, func = SingleFlight("test"), Computation()
+        caller = asyncio.ensure_future(flight.do("k", func, "v"))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        return func.cancelled
+
+    assert asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Binary uploads to JSONEndPoint reach process() as bytes
+"""
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from router.json import JSONEndPoint
+
+IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 16
+
+
+class RecordingEndPoint(JSONEndPoint):
+    def __init__(self):
+        super().__init__(coalesce=False)
+        self.requests = []
+
+    def process(self, request_body: dict) -> dict:
+        self.requests.append(request_body)
+        return {"ok": True}
+
+
+def _client(endpoint: JSONEndPoint) -> TestClient:
+    app = Starlette(
+        routes=[Route("/process", endpoint.get_request, methods=["GET", "POST"])]
+    )
+    return TestClient(app)
+
+
+def test_multipart_upload_is_passed_as_bytes():
+    endpoint = RecordingEndPoint()
+
+    response = _client(endpoint).post(
+        "/process",
+        data={"prompt": "Describe the image"},
+        files={"image": ("image.png", IMAGE, "image/png")},
+    )
+
+    assert response.status_code == 200
+    (request_body,) = endpoint.requests
+    assert request_body["prompt"] == "Describe the image"
+    assert isinstance(request_body["image"], bytes)
+    assert request_body["image"] == IMAGE
+
+
+def test_raw_image_body_is_passed_as_bytes():
+    endpoint = RecordingEndPoint()
+
+    response = _client(endpoint).post(
+        "/process?prompt=Describe",
+        content=IMAGE,
+        headers={"Content-Type": "image/png"},
+    )
+
+    assert response.status_code == 200
+    (request_body,) = endpoint.requests
+    assert request_body["prompt"] == "Describe"
+    assert isinstance(request_body["image"], bytes)
+    assert request_body["image"] == IMAGE
+
+
+def test_identical_uploads_share_a_key_and_different_ones_do_not():
+    endpoint = RecordingEndPoint()
+
+    key = endpoint._request_key({"prompt": "p", "image": IMAGE})
+
+    assert key == endpoint._request_key({"image": memoryview(IMAGE), "prompt": "p"})
+    assert key != endpoint._request_key({"prompt": "p", "image": IMAGE + b"\0"})
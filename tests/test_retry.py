@@ -0,0 +1,132 @@
+"""
+CallPolicy retries, deadlines, hedging and abandoned attempts
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.utils import utils_retry
+from backend.utils.utils_retry import CALL_HEDGES, CallPolicy, DeadlineExceeded
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class Flaky:
+    """Raises the given errors on the first calls, then returns "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retryable_error_is_retried_until_success():
+    policy = CallPolicy("test-retry", retries=3, initial_backoff=0)
+    func = Flaky(ServiceUnavailable("busy"), ServiceUnavailable("busy"))
+
+    assert policy.call(func) == "ok"
+    assert func.calls == 3
+
+
+def test_non_retryable_error_is_raised_at_once():
+    policy = CallPolicy("test-no-retry", retries=3, initial_backoff=0)
+    func = Flaky(ValueError("invalid argument"))
+
+    with pytest.raises(ValueError):
+        policy.call(func)
+    assert func.calls == 1
+
+
+def test_retries_stop_after_the_last_attempt():
+    policy = CallPolicy("test-exhausted", retries=2, initial_backoff=0)
+    func = Flaky(*[ServiceUnavailable("busy")] * 5)
+
+    with pytest.raises(ServiceUnavailable):
+        policy.call(func)
+    assert func.calls == 3
+
+
+def test_deadline_raises_deadline_exceeded():
+    policy = CallPolicy("test-deadline", retries=0, deadline=0.05)
+    release = threading.Event()
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        policy.call(release.wait, 5)
+    assert time.monotonic() - start < 1
+    release.set()
+
+
+def test_hedged_attempt_wins_when_the_first_is_slow():
+    policy = CallPolicy(
+        "test-hedge", retries=0, hedge=True, hedge_min_samples=1, hedge_min_delay=0.01
+    )
+    policy._latencies.extend([0.01] * 5)
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            return "first"
+        return "hedge"
+
+    won = CALL_HEDGES.value(policy="test-hedge", result="won")
+    assert policy.call(func) == "hedge"
+    assert CALL_HEDGES.value(policy="test-hedge", result="won") == won + 1
+    release.set()
+
+
+def test_stateful_call_never_runs_in_the_pool(monkeypatch):
+    def submit(*args, **kwargs):
+        raise AssertionError("stateful call submitted to the pool")
+
+    monkeypatch.setattr(utils_retry._executor, "submit", submit)
+    policy = CallPolicy("test-stateful", retries=0, deadline=5, hedge=True)
+    policy._latencies.extend([0.01] * 50)
+
+    assert policy.call(threading.get_ident, stateful=True) == threading.get_ident()
+
+
+def test_abandoned_attempt_is_released_when_it_finishes():
+    policy = CallPolicy("test-abandoned", retries=0, deadline=0.05, max_abandoned=1)
+    release = threading.Event()
+
+    with pytest.raises(DeadlineExceeded):
+        policy.call(release.wait, 5)
+    assert policy._abandoned == 1
+
+    # Over the limit, the next attempt runs in the caller's thread
+    assert policy.call(threading.get_ident) == threading.get_ident()
+
+    release.set()
+    for _ in range(100):
+        if policy._abandoned == 0:
+            break
+        time.sleep(0.01)
+    assert policy._abandoned == 0
+
+
+def test_async_call_retries_and_respects_deadline():
+    policy = CallPolicy("test-async", retries=3, initial_backoff=0, deadline=0.2)
+    func = Flaky(ServiceUnavailable("busy"))
+
+    async def flaky():
+        return func()
+
+    assert asyncio.run(policy.acall(flaky)) == "ok"
+    assert func.calls == 2
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(policy.acall(asyncio.sleep, 5))
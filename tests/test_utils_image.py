@@ -0,0 +1,26 @@
+"""
+Image input decoding: raw images pass through, base64 strings and bytes are decoded
+"""
+
+import base64
+
+from backend.utils.utils_image import to_image_bytes
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+JPEG = b"\xff\xd8\xff\xe0" + b"JFIF" * 16
+
+
+def test_raw_images_are_passed_through():
+    assert to_image_bytes(PNG) is PNG
+    assert to_image_bytes(JPEG) is JPEG
+    assert to_image_bytes(bytearray(PNG)) == PNG
+    assert to_image_bytes(memoryview(JPEG)) == JPEG
+
+
+def test_base64_is_decoded():
+    encoded = base64.b64encode(PNG)
+    assert to_image_bytes(encoded.decode()) == PNG
+    assert to_image_bytes(encoded) == PNG
+    assert to_image_bytes(bytearray(encoded)) == PNG
+    assert to_image_bytes(memoryview(encoded)) == PNG
+    assert to_image_bytes(base64.encodebytes(PNG)) == PNG